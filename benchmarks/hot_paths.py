@@ -0,0 +1,270 @@
+""" Throughput of the hot paths - env steps, action selection, evaluation, solving and SARSA - with regression tracking
+
+    python -m benchmarks.hot_paths --save-baseline      # on the commit to compare against
+    python -m benchmarks.hot_paths                      # after a change - flags anything slower than the baseline
+
+Run from the repository root as a module (as above) so that piggy can be imported.
+
+Every benchmark runs with fixed seeds --repeats times and reports the best of them (as timeit does - slower repeats
+are noise from the rest of the machine, not the code). Results are written as JSON (see
+--output) and compared against the baseline - any benchmark more than --threshold worse than it is flagged as a
+regression and the exit code is 1. Baselines are machine specific so are not kept in the repo.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from piggy.agent import Agent
+from piggy.environment import Environment, VectorEnvironment
+from piggy.evaluator import Evaluator
+from piggy.fixed_opponent_sarsa import FixedOpponentSarsa
+from piggy.policy_iteration import PolicyIteration
+from piggy.utils.create_policy import hold_at_n_policy
+from piggy.value_iteration import ValueIteration
+from definition import ROOT_DIR
+
+DEFAULT_BASELINE_PATH = os.path.join(ROOT_DIR, 'experiment_results', 'benchmarks', 'baseline.json')
+DEFAULT_OUTPUT_PATH = os.path.join(ROOT_DIR, 'experiment_results', 'benchmarks', 'latest.json')
+SOLVE_TARGET_SCORES = (20, 50, 100)
+
+
+def env_steps_per_second():
+    env = Environment(dice_sides=6, target_score=100)
+    actions = [int(a) for a in np.random.random(200000) < 0.8]
+    state = (0, 0, 0)
+    start_time = time.perf_counter()
+    for action in actions:
+        state, reward, go_again = env.take_action(state, action)
+        if reward or not go_again:
+            state = (0, 0, 0)
+    return len(actions) / (time.perf_counter() - start_time)
+
+
+def vector_env_steps_per_second():
+    vector_env = VectorEnvironment(dice_sides=6, target_score=100, seed=0)
+    states = vector_env.reset(10000)
+    actions = np.ones(10000, dtype=np.int32)
+    start_time = time.perf_counter()
+    for _ in range(200):
+        states, _, _ = vector_env.take_action(states, actions, auto_reset=True)
+    return 200 * 10000 / (time.perf_counter() - start_time)
+
+
+def agent_actions_per_second():
+    agent = Agent(initial_policy=hold_at_n_policy(target_score=100, hold_at=20))
+    states = [tuple(state) for state in np.random.randint(0, 100, size=(200000, 3)).tolist()]
+    start_time = time.perf_counter()
+    for state in states:
+        agent.select_action(state)
+    return len(states) / (time.perf_counter() - start_time)
+
+
+def evaluator_games_per_second():
+    evaluator = _get_evaluator()
+    start_time = time.perf_counter()
+    evaluator.evaluate(num_games=2000)
+    return 2000 / (time.perf_counter() - start_time)
+
+
+def batched_evaluator_games_per_second():
+    evaluator = _get_evaluator()
+    start_time = time.perf_counter()
+    evaluator.evaluate(num_games=100000, batch_size=10000, seed=0)
+    return 100000 / (time.perf_counter() - start_time)
+
+
+def sarsa_episodes_per_second():
+    sarsa = _get_sarsa()
+    start_time = time.perf_counter()
+    for _ in range(5000):
+        sarsa.run_episode()
+    return 5000 / (time.perf_counter() - start_time)
+
+
+def batched_sarsa_episodes_per_second():
+    sarsa = _get_sarsa()
+    start_time = time.perf_counter()
+    sarsa.run_batched(episodes=50000, evaluate_every=50000, batch_size=1000, seed=0, background_evaluation=False)
+    return 50000 / (time.perf_counter() - start_time)
+
+
+def value_iteration_seconds(target_score, engine):
+    value_iteration = ValueIteration(environment=Environment(dice_sides=6, target_score=target_score), eps=1e-6)
+    start_time = time.perf_counter()
+    value_iteration.run(engine=engine)
+    return time.perf_counter() - start_time
+
+
+def policy_iteration_seconds(target_score):
+    policy_iteration = PolicyIteration(environment=Environment(dice_sides=6, target_score=target_score))
+    start_time = time.perf_counter()
+    policy_iteration.run()
+    return time.perf_counter() - start_time
+
+
+def _get_evaluator():
+    env = Environment(dice_sides=6, target_score=100)
+    return Evaluator(env, player0=Agent(hold_at_n_policy(target_score=100, hold_at=20)),
+                     player1=Agent(hold_at_n_policy(target_score=100, hold_at=25)))
+
+
+def _get_sarsa():
+    env = Environment(dice_sides=6, target_score=100)
+    opponent = Agent(initial_policy=hold_at_n_policy(target_score=100, hold_at=20))
+    return FixedOpponentSarsa(env, opponent, eps=0.1, alpha=0.05, decay=1, seed=0)
+
+
+def get_benchmarks():
+    """
+    Returns
+    -------
+    benchmarks: list
+        (name, unit, higher_is_better, function) for every benchmark - each function returns its measurement
+    """
+    benchmarks = [('env steps', 'steps/s', True, env_steps_per_second),
+                  ('vector env steps', 'steps/s', True, vector_env_steps_per_second),
+                  ('agent select action', 'actions/s', True, agent_actions_per_second),
+                  ('evaluator games', 'games/s', True, evaluator_games_per_second),
+                  ('batched evaluator games', 'games/s', True, batched_evaluator_games_per_second),
+                  ('sarsa episodes', 'episodes/s', True, sarsa_episodes_per_second),
+                  ('batched sarsa episodes', 'episodes/s', True, batched_sarsa_episodes_per_second)]
+    for target_score in SOLVE_TARGET_SCORES:
+        for engine in ('numpy', 'exact'):
+            benchmarks.append(('value iteration {} target {}'.format(engine, target_score), 's', False,
+                               lambda target_score=target_score, engine=engine:
+                               value_iteration_seconds(target_score, engine)))
+        benchmarks.append(('policy iteration target {}'.format(target_score), 's', False,
+                           lambda target_score=target_score: policy_iteration_seconds(target_score)))
+    return benchmarks
+
+
+def run_benchmarks(repeats=5, name_filter=None):
+    """
+    Parameters
+    ----------
+    repeats: int, optional
+    name_filter: str, optional
+        only run benchmarks whose name contains this
+
+    Returns
+    -------
+    results: dict
+        'metadata' and 'benchmarks' - name -> {'value' (best of the repeats), 'unit', 'higher_is_better', 'samples'}
+    """
+    results = {'metadata': _get_metadata(repeats), 'benchmarks': {}}
+    for name, unit, higher_is_better, function in get_benchmarks():
+        if name_filter is not None and name_filter not in name:
+            continue
+        samples = []
+        for repeat in range(repeats):
+            random.seed(repeat)
+            np.random.seed(repeat)
+            samples.append(function())
+        best = max(samples) if higher_is_better else min(samples)
+        results['benchmarks'][name] = {'value': float(best),
+                                       'unit': unit,
+                                       'higher_is_better': higher_is_better,
+                                       'samples': samples}
+        print('{:<40} {:>14.4g} {}'.format(name, best, unit), file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Parameters
+    ----------
+    results: dict
+        from run_benchmarks
+    baseline: dict
+        from run_benchmarks
+    threshold: float
+        fraction by which a benchmark has to be worse than the baseline to count as a regression e.g. 0.1 for 10%
+
+    Returns
+    -------
+    rows: list
+        (name, baseline value, value, change, regressed) for every benchmark in both - change is the fractional
+        improvement (positive is better whichever way the benchmark's unit goes)
+    """
+    rows = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        baseline_value = baseline['benchmarks'][name]['value']
+        if result['higher_is_better']:
+            change = result['value'] / baseline_value - 1
+        else:
+            change = baseline_value / result['value'] - 1
+        rows.append((name, baseline_value, result['value'], change, change < -threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print('{:<40} {:>14} {:>14} {:>10}'.format('benchmark', 'baseline', 'current', 'change'))
+    for name, baseline_value, value, change, regressed in rows:
+        print('{:<40} {:>14.4g} {:>14.4g} {:>+9.1%}{}'.format(name, baseline_value, value, change,
+                                                              '  REGRESSION' if regressed else ''))
+    num_regressions = sum(regressed for *_, regressed in rows)
+    print('{} regression(s) worse than {:.0%}'.format(num_regressions, threshold))
+
+
+def _get_metadata(repeats):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': repeats}
+
+
+def _write_json(file_path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline too')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction by which a benchmark has to be worse than the baseline to be a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(repeats=args.repeats, name_filter=args.filter)
+    _write_json(args.output, results)
+    print('Results written to {}'.format(args.output))
+
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline at {} - run with --save-baseline to create one'.format(args.baseline))
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    rows = compare(results, baseline, args.threshold)
+    print_comparison(rows, args.threshold)
+    return 1 if any(regressed for *_, regressed in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+""" Episodes needed by FixedOpponentSarsa to reach a target win rate against 'hold at n' for several trace decays
+
+    python -m benchmarks.sarsa_lambda_convergence --target-score 30 --hold-at 10
+
+Run from the repository root as a module (as above) so that piggy can be imported.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from piggy.agent import Agent
+from piggy.best_response import BestResponse
+from piggy.environment import Environment
+from piggy.fixed_opponent_sarsa import FixedOpponentSarsa
+from piggy.utils.create_policy import hold_at_n_policy
+
+
+def episodes_to_target(sarsa, target_win_rate, max_episodes, check_every):
+    """
+    Train until the greedy policy's exact win rate reaches target_win_rate
+    Parameters
+    ----------
+    sarsa: FixedOpponentSarsa
+    target_win_rate: float
+    max_episodes: int
+    check_every: int
+        episodes between successive (exact) evaluations
+
+    Returns
+    -------
+    episodes: int or None
+        episodes played when the target was first reached - None if it wasn't reached within max_episodes
+    """
+    for episode in range(1, max_episodes + 1):
+        sarsa.run_episode()
+        sarsa.eps *= sarsa.decay
+        sarsa.alpha *= sarsa.decay
+        if episode % check_every == 0 and sarsa.evaluate_against_fixed_opponent() >= target_win_rate:
+            return episode
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target-score', type=int, default=30)
+    parser.add_argument('--hold-at', type=int, default=10)
+    parser.add_argument('--target-fraction', type=float, default=0.4,
+                        help='target win rate as a fraction of the way from the initial win rate to the best response')
+    parser.add_argument('--trace-decays', type=float, nargs='+', default=[0, 0.5, 0.8, 0.9, 0.95])
+    parser.add_argument('--seeds', type=int, default=3)
+    parser.add_argument('--max-episodes', type=int, default=200000)
+    parser.add_argument('--check-every', type=int, default=500)
+    args = parser.parse_args()
+
+    env = Environment(dice_sides=6, target_score=args.target_score)
+    opponent = Agent(initial_policy=hold_at_n_policy(target_score=args.target_score, hold_at=args.hold_at))
+
+    best_response = BestResponse(environment=env, opponent=opponent)
+    best_response.run()
+    np.random.seed(0)
+    initial_win_rate = FixedOpponentSarsa(env, opponent, eps=0, alpha=0, decay=1,
+                                          seed=0).evaluate_against_fixed_opponent()
+    target_win_rate = initial_win_rate + args.target_fraction * (best_response.win_probability() - initial_win_rate)
+    print('Target win rate: {:.2%}'.format(target_win_rate))
+
+    print('{:>12} {:>20} {:>12}'.format('trace decay', 'episodes (median)', 'seconds'))
+    for trace_decay in args.trace_decays:
+        episodes, seconds = [], []
+        for seed in range(args.seeds):
+            np.random.seed(seed)
+            random.seed(seed)
+            sarsa = FixedOpponentSarsa(env, opponent, eps=0.2, alpha=0.1, decay=0.99995, trace_decay=trace_decay,
+                                       seed=seed)
+            start_time = time.time()
+            episodes.append(episodes_to_target(sarsa, target_win_rate, args.max_episodes, args.check_every))
+            seconds.append(time.time() - start_time)
+        reached = [e for e in episodes if e is not None]
+        median = '{:.0f}'.format(np.median(reached)) if len(reached) == len(episodes) else 'not reached'
+        print('{:>12} {:>20} {:>12.1f}'.format(trace_decay, median, np.median(seconds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+import numpy as np
+
+from piggy.utils.policy_store import get_roll, load_array, save_array
 
 
 class Agent:
@@ -12,6 +15,42 @@ class Agent:
         """
         self.policy = initial_policy
 
+    @classmethod
+    def load(cls, file_path, environment=None, mmap=True):
+        """
+        Create an agent from a saved policy - see piggy.utils.policy_store (.npy files are also accepted)
+        Parameters
+        ----------
+        file_path: str
+        environment: piggy.environment.Environment, optional
+            if given the policy must be for the same game
+        mmap: bool, optional
+            if True (default) the policy is memory-mapped read-only so that processes using the same file share it
+
+        Returns
+        -------
+        agent: Agent
+        """
+        if file_path.endswith('.npy'):
+            return cls(initial_policy=np.load(file_path, mmap_mode='r' if mmap else None))
+        policy, metadata = load_array(file_path, mmap=mmap, environment=environment)
+        if metadata['kind'] != 'policy':
+            raise ValueError('{} holds a {} not a policy'.format(file_path, metadata['kind']))
+        return cls(initial_policy=policy)
+
+    def save(self, file_path, environment, playing_piglet=False):
+        """
+        Save the policy - see piggy.utils.policy_store
+        Parameters
+        ----------
+        file_path: str
+        environment: piggy.environment.Environment
+        playing_piglet: bool, optional
+        """
+        target_score = environment.target_score
+        save_array(file_path, get_roll(self.policy, target_score), 'policy', environment.dice_sides, target_score,
+                   playing_piglet, die=environment.die)
+
     def select_action(self, state):
         """
         Parameters
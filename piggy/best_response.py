@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from piggy.opponent_turn_cache import get_opponent_turn_cache
+from piggy.utils.common import PlayableStateIndex, won, lost
+from piggy.utils.layers import create_padded_value_function, get_hold_scores, get_layer_rows, solve_layer_newton
+from piggy.utils.policy_store import save_solution
+from definition import ROOT_DIR
+
+
+class BestResponse:
+
+    def __init__(self, environment, opponent):
+        """
+        Exact best response to a fixed opponent.
+
+        With the opponent's policy known their whole turn is just a stochastic transition of the environment (see
+        piggy.opponent_turn_cache) so finding the best response is a single player MDP:
+
+            V(a, b, t) = max(E(a + t, b), P(pig out)·E(a, b) + Σ_roll P(roll)·V(a, b, t + roll))
+            E(a, b) = Σ_g P(opponent adds g | opponent on b, you on a) * V(a, b + g, 0)
+
+        where the rolls are those of the environment's die and E(a, b) is the value of ending your turn on a - the
+        opponent winning contributes 0. This is solved one score_sum layer at a time as in
+        piggy.value_iteration.ValueIteration. Within a layer each row only depends on itself through the opponent
+        scoring 0, so the same Newton iteration as ValueIteration's exact engine solves every row to machine precision
+        in a handful of passes.
+
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        opponent: piggy.agent.Agent
+        """
+        self.environment = environment
+        self.opponent = opponent
+
+        target_score = environment.target_score
+        self.states = PlayableStateIndex(target_score=target_score)
+        self._V = create_padded_value_function(target_score, environment.die)
+        self.policy = np.zeros((target_score + 1,)*3)
+
+        # Probability of each outcome of the opponent's turn - [opponent_score, your_score, points added] where
+        # points added of target_score means the opponent won
+        self.opponent_turn_probabilities = get_opponent_turn_cache(environment, opponent).outcome_probabilities
+
+    def V(self, state):
+        """
+        Getter method for value function - Returns 1 if already won, 0 if lost and V(s) otherwise.
+        Parameters
+        ----------
+        state: tuple
+
+        Returns
+        -------
+        v: float
+        """
+        if won(state, self.environment.target_score):
+            return 1
+        elif lost(state, self.environment.target_score):
+            return 0
+        else:
+            return self._V[state[0], state[1], state[2]]
+
+    def run(self):
+        """
+        Solve for the best response - starting with score_sum 2*(target-1) and working backward to 0
+        """
+        target_score = self.environment.target_score
+        points = np.arange(1, target_score)
+
+        # end_of_turn_value[a, b] - E(a, b) - known once layer a + b has been solved (a = target_score is never used)
+        end_of_turn_value = np.zeros((target_score + 1, target_score))
+
+        for score_sum in tqdm(range(2 * (target_score - 1), -1, -1)):
+
+            your_score, opponent_score = get_layer_rows(score_sum, target_score)
+            turn_probabilities = self.opponent_turn_probabilities[opponent_score, your_score]
+
+            # Ending the turn on a: E(a, b) = P(opponent adds 0)·V(a, b, 0) + Σ_g>0 P(opponent adds g)·V(a, b + g, 0)
+            opponent_new_score = np.minimum(opponent_score[:, None] + points[None, :], target_score)  # clipped are lost
+            pig_out_alpha = np.sum(turn_probabilities[:, 1:target_score] *
+                                   self._V[your_score[:, None], opponent_new_score, 0], axis=1)
+            pig_out_beta = turn_probabilities[:, 0]
+
+            # Holding with turn score t ends the turn on a + t - in a higher layer
+            hold_value = end_of_turn_value[get_hold_scores(your_score, target_score), opponent_score[:, None]]
+
+            # Each row is only coupled to itself
+            x = np.full(len(your_score), 0.5)  # initial guess for V(a, b, 0) of each row
+            alpha, beta, roll, x, _ = solve_layer_newton(your_score, target_score, self.environment.die, hold_value,
+                                                         pig_out_alpha, pig_out_beta, coupling_value=x,
+                                                         coupled_pairs=False)
+
+            self._V[your_score, opponent_score, :target_score] = \
+                alpha[:, :target_score] + beta[:, :target_score] * x[:, None]
+            self.policy[your_score, opponent_score, :target_score] = roll
+            end_of_turn_value[your_score, opponent_score] = pig_out_alpha + pig_out_beta * x
+
+    def win_probability(self, starting_player=None):
+        """
+        Probability that the best response beats the opponent - only valid after run()
+        Parameters
+        ----------
+        starting_player: int, optional
+            0 for the best response, 1 for the opponent - if not given each is equally likely to start
+
+        Returns
+        -------
+        win_probability: float
+        """
+        target_score = self.environment.target_score
+        you_start = self._V[0, 0, 0]
+        turn_probabilities = self.opponent_turn_probabilities[0, 0, :target_score]
+        opponent_starts = np.sum(turn_probabilities * self._V[0, :target_score, 0])
+        if starting_player is None:
+            return (you_start + opponent_starts) / 2
+        return you_start if starting_player == 0 else opponent_starts
+
+    def save(self, output_dir, value_dtype=np.float64):
+        """
+        Save value function and policy - same format as piggy.value_iteration.ValueIteration.save
+        Parameters
+        ----------
+        output_dir: str
+        value_dtype: np.dtype, optional
+
+        Returns
+        -------
+        vf_filepath: str
+        policy_filepath: str
+        """
+        name = 'best_response__{}_side_die__target_{}'.format(self.environment.dice_sides, self.environment.target_score)
+        return save_solution(output_dir, name, self._V, self.policy, self.environment, False,
+                             value_dtype=value_dtype)
+
+
+if __name__ == '__main__':
+    """ Best response to 'hold at 20' """
+    import time
+    from piggy.agent import Agent
+    from piggy.environment import Environment
+    from piggy.utils.create_policy import hold_at_n_policy
+    _env = Environment(dice_sides=6, target_score=100)
+    _opponent = Agent(initial_policy=hold_at_n_policy(target_score=_env.target_score, hold_at=20))
+
+    start_time = time.time()
+    best_response = BestResponse(environment=_env, opponent=_opponent)
+    best_response.run()
+    print('Best response wins {:.2%} of games against hold at 20 ({:.1f}s)'.format(best_response.win_probability(),
+                                                                                 time.time() - start_time))
+    best_response.save(output_dir=os.path.join(ROOT_DIR, 'experiment_results'))
@@ -1,21 +1,30 @@
-import random
+import numpy as np
+
+from piggy.utils.die import Die
 
 
 class Environment:
 
-    def __init__(self, dice_sides, target_score):
+    def __init__(self, dice_sides, target_score, faces=None):
         """
 
         Parameters
         ----------
         dice_sides: int
-            number of sides on dice
+            number of sides on dice - may be None if faces is given
         target_score: int
+        faces: dict, optional
+            face -> (probability, points) for a biased or non-standard die - see piggy.utils.die. If not given the die
+            is fair with face 1 ending the turn and faces 2..dice_sides scoring their number
         """
-        self.dice_sides = dice_sides
+        if faces is not None and dice_sides not in (None, len(faces)):
+            raise ValueError('dice_sides={} but {} faces were given'.format(dice_sides, len(faces)))
+        self.dice_sides = len(faces) if faces is not None else dice_sides
         self.target_score = target_score
+        self.faces = faces
+        self.die = Die(faces) if faces is not None else Die.fair(dice_sides)
 
-    def take_action(self, state, action):
+    def take_action(self, state, action, random_state=None):
         """
         Take an action from current state
         Parameters
@@ -24,6 +33,8 @@ class Environment:
             (your_score, opponent_score, turn_score)
         action: int
             1 for roll, 0 for hold
+        random_state: random.Random, optional
+            rolls the die - defaults to the random module's global generator
 
         Returns
         -------
@@ -35,12 +46,12 @@ class Environment:
             whether it's this players go again
         """
         if action == 1:  # if action is to roll
-            dice_roll = random.randint(1, self.dice_sides)
-            if dice_roll == 1:
+            points = self.die.sample_one(random_state)
+            if points == 0:
                 go_again = False
                 turn_score = 0  # rolling a 1 resets turn score to zero and transitions to other players turn
             else:
-                turn_score = state[2] + dice_roll  # rolling 2-6 adds that number to your turn score and you get to go again
+                turn_score = state[2] + points  # any other roll adds its points to your turn score and you go again
                 go_again = True
             new_state = state[:2] + (turn_score,)
         else:  # action is to hold
@@ -51,3 +62,102 @@ class Environment:
 
         return new_state, reward, go_again
 
+
+
+class VectorEnvironment:
+
+    def __init__(self, dice_sides, target_score, seed=None, faces=None):
+        """
+        Batched counterpart to Environment - takes actions in many games at once. States are tuples of arrays
+        (your_score, opponent_score, turn_score) with the same point of view conventions as Environment.
+
+        Parameters
+        ----------
+        dice_sides: int
+            number of sides on dice - may be None if faces is given
+        target_score: int
+        seed: int or np.random.Generator, optional
+            seed for (or an existing) np.random.Generator used to roll the dice
+        faces: dict, optional
+            see Environment
+        """
+        if faces is not None and dice_sides not in (None, len(faces)):
+            raise ValueError('dice_sides={} but {} faces were given'.format(dice_sides, len(faces)))
+        self.dice_sides = len(faces) if faces is not None else dice_sides
+        self.target_score = target_score
+        self.die = Die(faces) if faces is not None else Die.fair(dice_sides)
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def like(cls, environment, seed=None):
+        """
+        VectorEnvironment for the same game as an Environment
+        Parameters
+        ----------
+        environment: Environment
+        seed: int or np.random.Generator, optional
+
+        Returns
+        -------
+        vector_environment: VectorEnvironment
+        """
+        return cls(environment.dice_sides, environment.target_score, seed=seed, faces=environment.faces)
+
+    def reset(self, num_games):
+        """
+        Returns the start of game state (0, 0, 0) for num_games games
+        Parameters
+        ----------
+        num_games: int
+
+        Returns
+        -------
+        states: tuple
+            (your_score, opponent_score, turn_score) arrays
+        """
+        return tuple(np.zeros(num_games, dtype=np.int32) for _ in range(3))
+
+    def take_action(self, states, actions, auto_reset=False, points=None):
+        """
+        Take an action in each game
+        Parameters
+        ----------
+        states: tuple
+            (your_score, opponent_score, turn_score) arrays
+        actions: np.ndarray
+            1 for roll, 0 for hold in each game
+        auto_reset: bool, optional
+            if True games that are won are returned to the start of game state (0, 0, 0) with go_again False
+        points: np.ndarray, optional
+            points scored by the roll of the die in each game (0 ends the turn) - if not given the dice are rolled
+            with self.rng. Only the entries of games that roll are used.
+
+        Returns
+        -------
+        new_states: tuple
+            (your_score, opponent_score, turn_score) arrays from the point of view of the player who just played
+        rewards: np.ndarray
+            1 for win, 0 otherwise
+        go_again: np.ndarray
+            bool array of whether it's this players go again
+        """
+        your_score, opponent_score, turn_score = states
+        roll = np.asarray(actions).astype(bool)
+
+        # Branch-free updates (multiplying by masks) are several times faster than np.where on random masks
+        if points is None:
+            points = self.die.sample(len(roll), self.rng)
+        go_again = roll & (points != 0)  # rolling 2-6 adds that number to your turn score and you get to go again
+        new_your_score = your_score + turn_score * ~roll  # holding adds current turn score to total
+        new_turn_score = (turn_score + points) * go_again  # holding or rolling a 1 resets turn score to zero
+
+        won = (new_your_score + new_turn_score) >= self.target_score
+        new_opponent_score = opponent_score
+        if auto_reset:
+            not_won = ~won
+            new_your_score *= not_won
+            new_opponent_score = opponent_score * not_won
+            new_turn_score *= not_won
+            go_again &= not_won
+
+        return (new_your_score, new_opponent_score, new_turn_score), won.view(np.uint8), go_again
@@ -1,8 +1,22 @@
 import random
+from collections import namedtuple
+from multiprocessing import Pool, shared_memory
+from statistics import NormalDist
 
 import numpy as np
 from tqdm import tqdm
 
+from piggy.agent import Agent
+from piggy.environment import VectorEnvironment
+from piggy.utils.policy_store import get_roll
+
+BATCHES_PER_CHUNK = 4  # batched evaluations are split into chunks of this many batches, each with its own seed stream
+
+# Result of Evaluator.evaluate_sequential - confidence_interval is (low, high) for p0_win_rate and decision is
+# 'greater' or 'less' if p0_win_rate was found to be above or below null_win_rate (None otherwise)
+SequentialEvaluation = namedtuple('SequentialEvaluation', ['p0_win_rate', 'confidence_interval', 'num_games',
+                                                           'decision'])
+
 
 class Evaluator:
 
@@ -21,18 +35,50 @@ class Evaluator:
         self.player1 = player1
         self.player_num_to_player = {0: player0, 1: player1}
 
-    def evaluate(self, num_games):
+    @classmethod
+    def from_policy_files(cls, environment, player0_file_path, player1_file_path):
+        """
+        Create an evaluator for two saved policies - memory-mapped, see piggy.agent.Agent.load
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        player0_file_path: str
+        player1_file_path: str
+
+        Returns
+        -------
+        evaluator: Evaluator
+        """
+        return cls(environment,
+                   player0=Agent.load(player0_file_path, environment=environment),
+                   player1=Agent.load(player1_file_path, environment=environment))
+
+    def evaluate(self, num_games, batch_size=None, seed=None, workers=1):
         """
         Play a specified number of games between the two agents - return their respective win rates
         Parameters
         ----------
         num_games: int
+        batch_size: int, optional
+            if given, games are played batch_size at a time in lockstep as numpy arrays (much faster) rather than one
+            at a time
+        seed: int, optional
+            master seed for the dice when batch_size is given - games are split into chunks of
+            BATCHES_PER_CHUNK * batch_size, each with its own independent seed stream, so a fixed seed gives the same
+            result for any number of workers
+        workers: int, optional
+            number of processes to play the chunks across when batch_size is given
 
         Returns
         -------
         p0_win_rate: float
         p1_win_rate: float
         """
+        if batch_size is not None:
+            return self._evaluate_batched(num_games, batch_size, seed, workers)
+        if workers != 1:
+            raise ValueError('Evaluating with multiple workers requires a batch_size')
+
         player0_wins = []  # store results as list of bools for each game indicating if p0 won
         for game_idx in tqdm(range(num_games)):
 
@@ -64,21 +110,293 @@ class Evaluator:
 
         return p0_win_rate, p1_win_rate
 
+    def evaluate_sequential(self, ci_width=0.01, confidence=0.95, null_win_rate=None, pairs_per_round=1000,
+                            max_games=10 ** 7, seed=None):
+        """
+        Estimate player0's win rate to a given precision with as few games as possible. Games are played in mirrored
+        pairs with common random numbers (see play_mirrored_pairs), pairs_per_round pairs at a time, until either
+
+        - the confidence interval is no wider than ci_width or
+        - (if null_win_rate is given) player0's win rate is confidently above or below null_win_rate
+
+        Each pair's mean result is one sample and the interval is the normal approximation to their mean. Checking the
+        test after every round is a repeated look at the data so for the test round k uses the wider interval at level
+        1 - (1 - confidence) / (k(k + 1)) - these error rates sum to 1 - confidence so the decision holds with the
+        requested confidence however many rounds it takes.
+
+        Parameters
+        ----------
+        ci_width: float, optional
+            full width of the confidence interval to stop at
+        confidence: float, optional
+        null_win_rate: float, optional
+            e.g. 0.5 to stop as soon as it is clear which player is better
+        pairs_per_round: int, optional
+        max_games: int, optional
+            stop after this many games regardless
+        seed: int, optional
+
+        Returns
+        -------
+        result: SequentialEvaluation
+        """
+        if max_games < 2:
+            raise ValueError('max_games must be at least 2 (one mirrored pair) - got {}'.format(max_games))
+        if pairs_per_round < 1:
+            raise ValueError('pairs_per_round must be at least 1 - got {}'.format(pairs_per_round))
+        if ci_width <= 0:
+            raise ValueError('ci_width must be positive - got {}'.format(ci_width))
+        if not 0 < confidence < 1:
+            raise ValueError('confidence must be between 0 and 1 - got {}'.format(confidence))
+
+        rng = np.random.default_rng(seed)
+        roll_table = self.get_roll_table()
+        normal = NormalDist()
+        z = normal.inv_cdf(1 - (1 - confidence) / 2)
+
+        num_pairs = 0
+        total = total_squares = 0.0  # of each pair's mean result
+        rounds = 0
+        decision = None
+        with tqdm(total=max_games) as progress_bar:
+            while True:
+                round_pairs = min(pairs_per_round, (max_games - 2 * num_pairs) // 2)
+                pair_results = play_mirrored_pairs(roll_table, self.environment, round_pairs, rng) / 2
+                num_pairs += round_pairs
+                total += pair_results.sum()
+                total_squares += (pair_results ** 2).sum()
+                rounds += 1
+                progress_bar.update(2 * round_pairs)
+
+                p0_win_rate = total / num_pairs
+                standard_error = np.sqrt(max(total_squares / num_pairs - p0_win_rate ** 2, 0) / max(num_pairs - 1, 1))
+                half_width = float(z * standard_error)
+                progress_bar.set_description('p0 win rate: {:.2%} ± {:.2%} -'.format(p0_win_rate, half_width))
+
+                if null_win_rate is not None:
+                    test_z = normal.inv_cdf(1 - (1 - confidence) / (2 * rounds * (rounds + 1)))
+                    if p0_win_rate - test_z * standard_error > null_win_rate:
+                        decision = 'greater'
+                    elif p0_win_rate + test_z * standard_error < null_win_rate:
+                        decision = 'less'
+                if 2 * half_width <= ci_width or decision is not None or 2 * (num_pairs + 1) > max_games:
+                    break
+
+        p0_win_rate = float(p0_win_rate)
+        return SequentialEvaluation(p0_win_rate, (p0_win_rate - half_width, p0_win_rate + half_width), 2 * num_pairs,
+                                    decision)
+
+    def _evaluate_batched(self, num_games, batch_size, seed, workers):
+        chunk_size = BATCHES_PER_CHUNK * batch_size
+        chunk_num_games = [min(chunk_size, num_games - start) for start in range(0, num_games, chunk_size)]
+        chunk_seeds = np.random.SeedSequence(seed).spawn(len(chunk_num_games))
+
+        roll_table = self.get_roll_table()
+        player0_win_count = 0
+        with tqdm(total=num_games) as progress_bar:
+            if workers == 1:
+                for num_chunk_games, chunk_seed in zip(chunk_num_games, chunk_seeds):
+                    player0_win_count += play_games(roll_table, self.environment, num_chunk_games, batch_size,
+                                                    rng=np.random.default_rng(chunk_seed),
+                                                    progress_callback=progress_bar.update)
+            else:
+                # Workers read the roll table from shared memory rather than each receiving a pickled copy
+                roll_table_memory = shared_memory.SharedMemory(create=True, size=roll_table.nbytes)
+                try:
+                    np.ndarray(roll_table.shape, roll_table.dtype, buffer=roll_table_memory.buf)[:] = roll_table
+                    chunks = [(self.environment, num_chunk_games, batch_size, chunk_seed)
+                              for num_chunk_games, chunk_seed in zip(chunk_num_games, chunk_seeds)]
+                    with Pool(processes=workers, initializer=_attach_roll_table,
+                              initargs=(roll_table_memory.name, roll_table.shape, roll_table.dtype)) as pool:
+                        for chunk_player0_win_count, num_chunk_games in pool.imap_unordered(_play_chunk, chunks):
+                            player0_win_count += chunk_player0_win_count
+                            progress_bar.update(num_chunk_games)
+                finally:
+                    roll_table_memory.close()
+                    roll_table_memory.unlink()
+
+        p0_win_rate = player0_win_count / num_games
+        p1_win_rate = 1 - p0_win_rate
+
+        return p0_win_rate, p1_win_rate
+
+    def get_roll_table(self):
+        """
+        Returns both agents' policies stacked into one flat boolean array for fancy indexing - entry
+        ((player * target + your_score) * target + opponent_score) * target + turn_score is True if player rolls
+        (always the case with a turn score of 0, as in piggy.agent.Agent)
+
+        Returns
+        -------
+        roll_table: np.ndarray
+        """
+        target_score = self.environment.target_score
+        roll_table = np.stack([get_roll(player.policy, target_score) for player in (self.player0, self.player1)])
+        roll_table[:, :, :, 0] = True
+        return roll_table.ravel()
+
+
+def play_games(roll_table, environment, num_games, batch_size, rng, progress_callback=None):
+    """
+    Play num_games games batch_size at a time in lockstep - at each step every game in the batch takes one action
+    and as soon as a game finishes its slot in the batch is used to start the next one.
+    Parameters
+    ----------
+    roll_table: np.ndarray
+        from Evaluator.get_roll_table
+    environment: piggy.environment.Environment
+    num_games: int
+    batch_size: int
+    rng: np.random.Generator
+    progress_callback: callable, optional
+        called with the number of games finished at each step
+
+    Returns
+    -------
+    player0_win_count: int
+    """
+    target_score = environment.target_score
+    vector_environment = VectorEnvironment.like(environment, seed=rng)
+
+    # State of each game in the batch from the pov of the current player
+    batch_size = min(batch_size, num_games)
+    your_score, opponent_score, turn_score = vector_environment.reset(batch_size)
+    player = rng.integers(0, 2, size=batch_size, dtype=np.int32)  # pick random player to start
+
+    games_started = batch_size
+    player0_win_count = 0
+    while len(player) > 0:
+        roll = roll_table[((player * target_score + your_score) * target_score + opponent_score) * target_score
+                          + turn_score]
+        (your_score, opponent_score, turn_score), reward, go_again = \
+            vector_environment.take_action((your_score, opponent_score, turn_score), roll)
+
+        # Games can only be won by rolling - when a turn ends switch to the other player's pov instead
+        game_won = reward.view(bool)
+        turn_over = ~go_again
+        swap = (opponent_score - your_score) * turn_over
+        your_score += swap
+        opponent_score -= swap
+        player ^= turn_over
+
+        num_won = np.count_nonzero(game_won)
+        if num_won > 0:
+            player0_win_count += np.count_nonzero(player[game_won] == 0)
+            if progress_callback is not None:
+                progress_callback(num_won)
+
+            # Start new games in the finished games' slots until num_games have been started, then shrink the batch
+            num_new = min(num_won, num_games - games_started)
+            games_started += num_new
+            won_idx = np.flatnonzero(game_won)
+            restart_idx, drop_idx = won_idx[:num_new], won_idx[num_new:]
+            your_score[restart_idx] = opponent_score[restart_idx] = turn_score[restart_idx] = 0
+            player[restart_idx] = rng.integers(0, 2, size=num_new, dtype=np.int32)
+            if len(drop_idx) > 0:
+                keep = np.ones(len(player), dtype=bool)
+                keep[drop_idx] = False
+                your_score, opponent_score, turn_score, player = \
+                    your_score[keep], opponent_score[keep], turn_score[keep], player[keep]
+
+    return player0_win_count
+
+
+def play_mirrored_pairs(roll_table, environment, num_pairs, rng):
+    """
+    Play num_pairs pairs of games in lockstep. Player0 starts the first game of each pair and player1 the second
+    (mirrored starts) and the dice are common to both - each seat (starting or second player) has its own stream of
+    rolls and the k-th roll from the starting seat is the same in both games, as is the k-th roll from the second seat
+    (common random numbers). Dice that favour whoever starts then favour each player once, so the pair's results are
+    negatively correlated and their mean varies less than that of two independent games.
+    Parameters
+    ----------
+    roll_table: np.ndarray
+        from Evaluator.get_roll_table
+    environment: piggy.environment.Environment
+    num_pairs: int
+    rng: np.random.Generator
+
+    Returns
+    -------
+    player0_wins: np.ndarray
+        number of each pair's two games won by player0 (0, 1 or 2)
+    """
+    target_score = environment.target_score
+    vector_environment = VectorEnvironment.like(environment)
+
+    # Games 2i and 2i+1 are pair i - player is the current player of each, starting with 0 and 1 respectively
+    your_score, opponent_score, turn_score = vector_environment.reset(2 * num_pairs)
+    pair = np.repeat(np.arange(num_pairs), 2)
+    starting_player = np.tile(np.array([0, 1], dtype=np.int32), num_pairs)
+    player = starting_player.copy()
+    rolls_taken = np.zeros((2 * num_pairs, 2), dtype=np.int64)  # by each seat in each game
+    stream_length = 4 * target_score // vector_environment.die.max_points + 1
+    dice = vector_environment.die.sample((num_pairs, 2, stream_length), rng)  # points scored by each roll
+
+    player0_wins = np.zeros(num_pairs, dtype=np.int64)
+    while len(player) > 0:
+        roll = roll_table[((player * target_score + your_score) * target_score + opponent_score) * target_score
+                          + turn_score]
+        seat = player ^ starting_player
+        game = np.arange(len(player))
+        seat_rolls_taken = rolls_taken[game, seat]
+        if seat_rolls_taken.max() >= dice.shape[2]:  # a stream has run out - double the length of all of them
+            dice = np.concatenate([dice, vector_environment.die.sample(dice.shape, rng)], axis=2)
+        (your_score, opponent_score, turn_score), reward, go_again = \
+            vector_environment.take_action((your_score, opponent_score, turn_score), roll,
+                                           points=dice[pair, seat, seat_rolls_taken])
+        rolls_taken[game, seat] += roll
+
+        # As in play_games - when a turn ends switch to the other player's pov
+        game_won = reward.view(bool)
+        turn_over = ~go_again
+        swap = (opponent_score - your_score) * turn_over
+        your_score += swap
+        opponent_score -= swap
+        player ^= turn_over
+
+        if game_won.any():
+            np.add.at(player0_wins, pair[game_won], player[game_won] == 0)
+            keep = ~game_won
+            your_score, opponent_score, turn_score, player, starting_player, pair, rolls_taken = \
+                your_score[keep], opponent_score[keep], turn_score[keep], player[keep], starting_player[keep], \
+                pair[keep], rolls_taken[keep]
+
+    return player0_wins
+
+
+# Set in each worker process by _attach_roll_table - the shared memory is kept open for the life of the worker
+_worker_roll_table_memory = None
+_worker_roll_table = None
+
+
+def _attach_roll_table(shared_memory_name, shape, dtype):
+    global _worker_roll_table_memory, _worker_roll_table
+    _worker_roll_table_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    _worker_roll_table = np.ndarray(shape, dtype, buffer=_worker_roll_table_memory.buf)
+
+
+def _play_chunk(chunk):
+    environment, num_games, batch_size, seed = chunk
+    player0_win_count = play_games(_worker_roll_table, environment, num_games, batch_size,
+                                   rng=np.random.default_rng(seed))
+    return player0_win_count, num_games
+
 
 if __name__ == '__main__':
     """ testing """
+    import os
     from matplotlib import pyplot as plt
     from piggy.utils.create_policy import hold_at_n_policy
     from piggy.environment import Environment
-    from piggy.agent import Agent
+    from piggy.solution_cache import get_optimal_agent
     target = 100
     env = Environment(dice_sides=6, target_score=target)
 
     p0 = Agent(initial_policy=hold_at_n_policy(target_score=target, hold_at=20))
 
-    optimal_policy = np.load('/home/luka/PycharmProjects/Piggy/experiment_results/standard_pig_optimal_policy.npy')
-    p1 = Agent(initial_policy=optimal_policy)
+    p1 = get_optimal_agent(env)
 
     eval = Evaluator(environment=env, player0=p0, player1=p1)
-    p0_win_rate, p1_win_rate = eval.evaluate(num_games=100000)
+    p0_win_rate, p1_win_rate = eval.evaluate(num_games=100000, batch_size=10000, seed=0, workers=os.cpu_count())
     print('Optimal policy won {:.1%} of games'.format(p1_win_rate))
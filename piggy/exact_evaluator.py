@@ -0,0 +1,128 @@
+import numpy as np
+
+from piggy.utils.layers import backward_pass, get_hold_scores, get_layer_rows, solve_coupled_pairs
+from piggy.utils.policy_store import get_roll
+
+
+class ExactEvaluator:
+
+    def __init__(self, environment, player0, player1):
+        """
+        Class for computing the exact probability of each of two agents beating the other - an exact alternative to
+        piggy.evaluator.Evaluator.
+
+        With both policies fixed the game is a Markov chain that can be solved layer by layer in the same way as
+        piggy.value_iteration.ValueIteration but with no max. U_p(a, b, t) - the probability that player p wins when it
+        is their turn with your_score a, opponents_score b and turn_score t - satisfies
+
+            U_p(a, b, t) = 1 - U_q(b, a + t, 0)                                                      if p holds
+            U_p(a, b, t) = P(pig out)·(1 - U_q(b, a, 0)) + Σ_roll P(roll)·U_p(a, b, t + roll)     if p rolls
+
+        where q is the other player and the rolls are those of the environment's die. The rows of both players in a
+        layer are interleaved into a single backward pass after which each U_p(a, b, 0) and U_q(b, a, 0) pair is solved
+        for directly.
+
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        player0: piggy.agent.Agent
+        player1: piggy.agent.Agent
+        """
+        self.environment = environment
+        self.player0 = player0
+        self.player1 = player1
+        self._start_of_turn_values = None
+
+    def win_probability(self, starting_player=None):
+        """
+        Probability that player0 wins
+        Parameters
+        ----------
+        starting_player: int, optional
+            0 or 1 - if not given each player is equally likely to start (as in piggy.evaluator.Evaluator)
+
+        Returns
+        -------
+        p0_win_probability: float
+        """
+        if self._start_of_turn_values is None:
+            self._start_of_turn_values = self.solve()
+
+        p0_starts = self._start_of_turn_values[0, 0, 0]
+        p1_starts = 1 - self._start_of_turn_values[1, 0, 0]
+        if starting_player is None:
+            return (p0_starts + p1_starts) / 2
+        return p0_starts if starting_player == 0 else p1_starts
+
+    def evaluate(self):
+        """
+        Exact counterpart to piggy.evaluator.Evaluator.evaluate
+
+        Returns
+        -------
+        p0_win_rate: float
+        p1_win_rate: float
+        """
+        p0_win_rate = self.win_probability()
+        return p0_win_rate, 1 - p0_win_rate
+
+    def solve(self):
+        """
+        Solve for the win probability of the player whose turn it is at the start of each turn
+
+        Returns
+        -------
+        start_of_turn_values: np.ndarray
+            [2, target_score + 1, target_score + 1] array of U_p(your_score, opponent_score, 0) for each player p
+        """
+        target_score = self.environment.target_score
+        die = self.environment.die
+
+        # Rolling with a turn score of 0 is enforced by backward_pass (as in piggy.agent.Agent)
+        rolls = np.stack([get_roll(player.policy, target_score) for player in (self.player0, self.player1)])
+
+        start_of_turn_values = np.zeros((2, target_score + 1, target_score + 1))
+        start_of_turn_values[:, target_score, :] = 1  # already won (opponent score target_score means already lost)
+
+        for score_sum in range(2 * (target_score - 1), -1, -1):
+
+            your_score, opponent_score = get_layer_rows(score_sum, target_score)
+
+            # The rows of both players are interleaved - (a, player0), (a, player1), (a + 1, player0)... - so that the
+            # reversed row order maps each U_p(a, b, 0) to the U_q(b, a, 0) it is coupled to
+            player = np.tile([0, 1], len(your_score))
+            your_score, opponent_score = np.repeat(your_score, 2), np.repeat(opponent_score, 2)
+
+            hold_value = 1 - start_of_turn_values[1 - player[:, None], opponent_score[:, None],
+                                                  get_hold_scores(your_score, target_score)]
+            roll = rolls[player, your_score, opponent_score]
+            ones = np.ones(len(your_score))
+
+            alpha, beta, _ = backward_pass(your_score, target_score, die, hold_value, pig_out_alpha=ones,
+                                           pig_out_beta=-ones, roll=roll)
+            start_of_turn_values[player, your_score, opponent_score] = solve_coupled_pairs(alpha[:, 0], beta[:, 0])
+
+        return start_of_turn_values
+
+
+if __name__ == '__main__':
+    """ Compare with Monte Carlo evaluation """
+    import time
+    from piggy.agent import Agent
+    from piggy.environment import Environment
+    from piggy.evaluator import Evaluator
+    from piggy.utils.create_policy import hold_at_n_policy
+    target = 100
+    env = Environment(dice_sides=6, target_score=target)
+    p0 = Agent(initial_policy=hold_at_n_policy(target_score=target, hold_at=15))
+    p1 = Agent(initial_policy=hold_at_n_policy(target_score=target, hold_at=25))
+
+    start_time = time.time()
+    exact_p0_win_rate, _ = ExactEvaluator(environment=env, player0=p0, player1=p1).evaluate()
+    print('Exact: {:.4f} ({:.2f}s)'.format(exact_p0_win_rate, time.time() - start_time))
+
+    num_games = 1000000
+    mc_p0_win_rate, _ = Evaluator(environment=env, player0=p0, player1=p1).evaluate(num_games=num_games,
+                                                                                    batch_size=10000, seed=0)
+    print('Monte Carlo: {:.4f} ± {:.4f}'.format(mc_p0_win_rate,
+                                                1.96 * np.sqrt(mc_p0_win_rate * (1 - mc_p0_win_rate) / num_games)))
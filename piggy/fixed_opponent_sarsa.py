@@ -1,21 +1,82 @@
 import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 from tqdm import tqdm
-import tensorflow as tf
 
-from piggy.utils.common import won_or_lost
+from piggy.utils.instrumentation import maybe_timer
 from piggy.utils.io import create_directory_path_with_timestamp
+from piggy.utils.metrics import TensorBoardSink
 from piggy.evaluator import Evaluator
+from piggy.exact_evaluator import ExactEvaluator
 from piggy.agent import Agent
+from piggy.environment import VectorEnvironment
+from piggy.opponent_turn_cache import get_opponent_turn_cache
+
+TRACE_CUTOFF = 1e-3  # eligibility traces below this are dropped
+
+
+def create_padded_Q(environment):
+    """
+    Create a randomly initialised state-action value function array Q(s, a) - 4D array (your_score, opponent_score,
+    turn_score, action) - padded so that every state that can follow a playable state (including won and lost states)
+    is inside it. Q(s,⋅) is 0 in every terminal state, as SARSA requires.
+
+    Parameters
+    ----------
+    environment: piggy.environment.Environment
+
+    Returns
+    -------
+    Q: np.ndarray
+        [target_score + 1, target_score + 1, target_score + die.max_points, 2] array
+    terminal: np.ndarray
+        whether each state of Q is won or lost
+    """
+    target_score = environment.target_score
+    shape = (target_score + 1, target_score + 1, target_score + environment.die.max_points)
+    your_score, opponent_score, turn_score = np.indices(shape)
+    terminal = (your_score + turn_score >= target_score) | (opponent_score >= target_score)
+    Q = np.random.random(size=shape + (2,)) * ~terminal[..., None]
+    return Q, terminal
+
+
+def apply_merged_td_updates(flat_Q, state_idx, td_error, alpha):
+    """
+    Apply a batch of TD updates to Q in place - the k updates to any one (s, a) are merged into one, equivalent to
+    applying them one after another if they shared the same target: Q(s,a) ← Q(s,a) + (1 - (1 - α)^k)·mean(δ)
+    (α is the mean of their learning rates)
+
+    Parameters
+    ----------
+    flat_Q: np.ndarray
+        flattened view onto Q
+    state_idx: np.ndarray
+        index into flat_Q of each update's (s, a)
+    td_error: np.ndarray
+        δ of each update
+    alpha: np.ndarray
+        learning rate of each update
+
+    Returns
+    -------
+    num_updated: int
+        number of distinct (s, a) updated
+    """
+    unique_idx, inverse, counts = np.unique(state_idx, return_inverse=True, return_counts=True)
+    mean_td_error = np.bincount(inverse, weights=td_error) / counts
+    mean_alpha = np.bincount(inverse, weights=alpha) / counts
+    flat_Q[unique_idx] += (1 - (1 - mean_alpha) ** counts) * mean_td_error
+    return len(unique_idx)
 
 
 class FixedOpponentSarsa:
 
-    def __init__(self, environment, opponent, eps, alpha, decay):
+    def __init__(self, environment, opponent, eps, alpha, decay, trace_decay=0, seed=None):
         """
-        Learn an optimal policy against a fixed opponent using SARSA.
+        Learn an optimal policy against a fixed opponent using SARSA - or SARSA(λ) if trace_decay is non-zero.
 
         Initialize learning rate α, exploration rate ε, decay rate λ and discount factor γ
         Initialize state-action value function Q(s,a) arbitrarily for each s∈S, a∈A
@@ -33,6 +94,16 @@ class FixedOpponentSarsa:
             ε ← ε·λ (decay ε)
             α ← α·λ (decay α)
 
+        With trace_decay ζ > 0 each update instead follows SARSA(ζ) with replacing eligibility traces - the TD error
+        δ = (r + γQ(s',a')) - Q(s,a) is applied to every recently visited (s, a) in proportion to its trace e:
+
+                e(s,a) ← 1
+                Q(x,y) ← Q(x,y) + α·δ·e(x,y) for every (x, y) with a trace
+                e(x,y) ← γζ·e(x,y)
+
+        As the only reward comes at the end of the game this passes credit back many states per visit rather than one.
+        Traces are kept for the current episode only, in a dict of the entries that are still above TRACE_CUTOFF, so
+        each update costs at most log(TRACE_CUTOFF) / log(ζ) operations however large Q is.
 
         Parameters
         ----------
@@ -43,18 +114,29 @@ class FixedOpponentSarsa:
             learning rate
         decay: float
             factor by which we decay eps and alpha each episode e.g. ε' = decay * ε
+        trace_decay: float, optional
+            ζ in [0, 1) - the λ of SARSA(λ). 0 (default) is one-step SARSA.
+        seed: int, optional
+            seeds the generator sampling the opponent's turns. By default it is drawn from the global random module, so
+            random.seed still makes a run reproducible.
         """
 
         self.environment = environment
         self.opponent = opponent
+        self.opponent_turn_cache = get_opponent_turn_cache(environment, opponent)
+        # samples this learner's opponent turns - the cache is shared
+        self.opponent_turn_random = random.Random(random.getrandbits(64) if seed is None else seed)
+        self.random_state = None  # rolls our dice and explores in run_episode - None for the random module
 
         self.eps = eps
         self.alpha = alpha
         self.decay = decay
+        self.trace_decay = trace_decay
 
-        # Initialise state-action value function array Q(s, a) - 4D array (your_score, opponent_score, turn_score, action)
-        shape = (environment.target_score,)*3 + (2,)
-        self._Q = np.random.random(size=shape)
+        # Q(s,⋅) of terminal states is never updated
+        self._Q, self._terminal = create_padded_Q(environment)
+
+        self._instrumentation = None  # set for the duration of an instrumented run
 
     def Q(self, s, a):
         """
@@ -70,13 +152,10 @@ class FixedOpponentSarsa:
         -------
         q: float
         """
-        if won_or_lost(s, target_score=self.environment.target_score):
-            q = 0  # SARSA algorithm requires that Q(s',⋅)=0 in all terminal states
-        else:
-            q = self._Q[s[0], s[1], s[2], a]
-        return q
+        return self._Q[s[0], s[1], s[2], a]  # terminal states are held at 0
 
-    def run(self, episodes, evaluate_every, output_dir):
+    def run(self, episodes, evaluate_every, output_dir=None, background_evaluation=True, metrics_sink=None,
+            instrumentation=None):
         """
         Run SARSA algorithm
         Parameters
@@ -84,72 +163,265 @@ class FixedOpponentSarsa:
         episodes: int
         evaluate_every: int
             number of episodes between successive evaluations against fixed opponent
-        output_dir: str
+        output_dir: str, optional
+            if given (and metrics_sink is not) metrics are written here as tensorboard logs
+        background_evaluation: bool, optional
+            if True evaluations run in a separate process while training carries on - an evaluation that falls due
+            while the previous one is still running is skipped
+        metrics_sink: piggy.utils.metrics.MetricsSink, optional
+            where to log win rate, ε and α at each evaluation - see piggy.utils.metrics
+        instrumentation: piggy.utils.instrumentation.Instrumentation, optional
+            if given - times our turns, the opponent's turns and evaluations, counts episodes, env steps, Q updates and
+            opponent turns and records each evaluation and a summary of the run (including env steps per second)
         """
-        # Metrics
-        tensorboard_writer = tf.summary.create_file_writer(output_dir)
-        latest_win_rate = 0
-
+        self._instrumentation = instrumentation
+        run_recorder = _RunRecorder(instrumentation, 'run')
         progress_bar = tqdm(range(episodes))
+        with _EvaluationSchedule(self, progress_bar, background_evaluation, output_dir, metrics_sink,
+                                 instrumentation) as evaluation_schedule:
+            for episode in progress_bar:
 
-        for episode in progress_bar:
-
-            state = (0, 0, 0)
+                # Periodically evaluate against fixed opponent - metrics written to the configured sink (if any)
+                if episode % evaluate_every == 0:
+                    evaluation_schedule.evaluate(episode)
+                evaluation_schedule.poll()
 
-            game_over = False
-            action = 1  # always roll at start of game
-            while not game_over:
+                self.run_episode()
 
-                progress_bar.set_description('state: {} - latest win rate: {:.1%} -'.format(state, latest_win_rate), refresh=True)
+                # Decay eps and alpha
+                self.eps *= self.decay
+                self.alpha *= self.decay
 
-                # Take chosen action in current state
-                new_state, reward, go_again = self.environment.take_action(state, action)
-                game_won = bool(reward)
+        self._instrumentation = None
+        run_recorder.finish()
 
-                # If it's no longer our turn then the opponent acts as part of environment and transitions us to the
-                # next state in which it is our turn
-                game_lost = False
-                if not go_again and not game_won:
-                    new_state, game_lost = self.opponents_turn(new_state)
+    def run_batched(self, episodes, evaluate_every, output_dir=None, batch_size=1000, seed=None,
+                    background_evaluation=True, metrics_sink=None, instrumentation=None):
+        """
+        Run SARSA on batch_size independent games at once in lockstep - ε-greedy actions are selected for all games
+        in one go and all of their TD updates are applied together. As soon as a game finishes its slot is used to
+        start the next episode. Each game uses the ε and α of its own episode, i.e. ε·λ^episode and α·λ^episode.
 
-                # Select action from new state - will be None if new_state is terminal
-                new_action = self.select_e_greedy_action(new_state)
+        When several games update the same (s, a) in the same step their updates are merged into one - see
+        apply_merged_td_updates.
 
-                # Update Q(s,a) - Note Q(s',a') is forced to 0 if new_state s' is terminal
-                self._Q[state[0], state[1], state[2], action] += \
-                    self.alpha * ((reward + self.Q(new_state, new_action)) - self.Q(state, action))
+        Parameters
+        ----------
+        episodes: int
+        evaluate_every: int
+            number of episodes between successive evaluations against fixed opponent
+        output_dir: str, optional
+            see run()
+        batch_size: int, optional
+        seed: int, optional
+            seed for the dice, the opponent's turns and exploration
+        background_evaluation: bool, optional
+            see run()
+        metrics_sink: piggy.utils.metrics.MetricsSink, optional
+            see run()
+        instrumentation: piggy.utils.instrumentation.Instrumentation, optional
+            see run()
+        """
+        if self.trace_decay > 0:
+            raise ValueError('run_batched only supports one-step SARSA (trace_decay=0)')
+
+        target_score = self.environment.target_score
+        vector_environment = VectorEnvironment.like(self.environment, seed=seed)
+        rng = vector_environment.rng
+
+        flat_Q = self._Q.reshape(-1)  # view onto self._Q
+        q_shape = self._Q.shape
+        initial_eps, initial_alpha = self.eps, self.alpha
+
+        # State of each game (always from our pov at the start of our move) and the episode it is playing
+        batch_size = min(batch_size, episodes)
+        your_score, opponent_score, turn_score = vector_environment.reset(batch_size)
+        action = np.ones(batch_size, dtype=np.int32)  # always roll at start of game
+        episode = np.arange(batch_size)
+        episodes_started = batch_size
+        episodes_finished = 0
+
+        run_recorder = _RunRecorder(instrumentation, 'run_batched')
+        progress_bar = tqdm(total=episodes)
+        with _EvaluationSchedule(self, progress_bar, background_evaluation, output_dir, metrics_sink,
+                                 instrumentation) as evaluation_schedule:
+            evaluation_schedule.evaluate(0)
+            next_evaluation = evaluate_every
+
+            while len(episode) > 0:
+                with maybe_timer(instrumentation, 'our turn'):
+                    state_idx = np.ravel_multi_index((your_score, opponent_score, turn_score, action), q_shape)
+
+                    # Take chosen actions - then the opponent takes their turn in every game where our turn ended
+                    (your_score, opponent_score, turn_score), reward, go_again = \
+                        vector_environment.take_action((your_score, opponent_score, turn_score), action)
+                    opponents_turn = np.flatnonzero(~go_again & (reward == 0))
+
+                with maybe_timer(instrumentation, 'opponent turn'):
+                    outcome = self.opponent_turn_cache.sample(opponent_score[opponents_turn],
+                                                              your_score[opponents_turn], rng=rng)
+                    # An outcome of target_score means the opponent won - their score is set to the target (lost)
+                    opponent_score[opponents_turn] = np.minimum(opponent_score[opponents_turn] + outcome, target_score)
+                    game_over = (reward == 1) | (opponent_score >= target_score)
+
+                with maybe_timer(instrumentation, 'our turn'):
+                    # Select ε-greedy actions from the new states - Q(s',a') is 0 in terminal states so needs no masking
+                    eps = initial_eps * self.decay ** episode
+                    new_action = np.argmax(self._Q[your_score, opponent_score, turn_score], axis=1).astype(np.int32)
+                    explore = rng.random(len(episode)) < eps
+                    new_action[explore] = rng.integers(0, 2, size=np.count_nonzero(explore))
+                    next_q = flat_Q[np.ravel_multi_index((your_score, opponent_score, turn_score, new_action), q_shape)]
+
+                    # TD updates - duplicate (s, a) in the batch are merged
+                    td_error = (reward + next_q) - flat_Q[state_idx]
+                    num_updated = apply_merged_td_updates(flat_Q, state_idx, td_error,
+                                                          alpha=initial_alpha * self.decay ** episode)
+
+                if instrumentation is not None:
+                    instrumentation.count('env steps', len(episode))
+                    instrumentation.count('opponent turns', len(opponents_turn))
+                    instrumentation.count('Q updates', num_updated)
 
-                # Increment
-                state = new_state
                 action = new_action
-                game_over = game_won or game_lost
-
-                # Periodically evaluate against fixed opponent - logs written to tensorboard
-                if episode % evaluate_every == 0:
-                    latest_win_rate = self.evaluate_against_fixed_opponent()
-                    with tensorboard_writer.as_default():
-                        tf.summary.scalar('win rate vs fixed opponent', latest_win_rate, step=episode)
-                        tf.summary.scalar('exploration rate ε', self.eps, step=episode)
-                        tf.summary.scalar('learning rate α', self.alpha, step=episode)
-
-
-        # Decay eps and alpha
-        self.eps *= self.decay
-        self.alpha *= self.decay
+                num_over = np.count_nonzero(game_over)
+                if num_over > 0:
+                    progress_bar.update(num_over)
+                    episodes_finished += num_over
+                    if instrumentation is not None:
+                        instrumentation.count('episodes', num_over)
+
+                    # Start new episodes in the finished games' slots until all have been started, then shrink
+                    num_new = min(num_over, episodes - episodes_started)
+                    over_idx = np.flatnonzero(game_over)
+                    restart_idx, drop_idx = over_idx[:num_new], over_idx[num_new:]
+                    your_score[restart_idx] = opponent_score[restart_idx] = turn_score[restart_idx] = 0
+                    action[restart_idx] = 1
+                    episode[restart_idx] = np.arange(episodes_started, episodes_started + num_new)
+                    episodes_started += num_new
+                    if len(drop_idx) > 0:
+                        keep = np.ones(len(episode), dtype=bool)
+                        keep[drop_idx] = False
+                        your_score, opponent_score, turn_score, action, episode = \
+                            your_score[keep], opponent_score[keep], turn_score[keep], action[keep], episode[keep]
+
+                    self.eps = initial_eps * self.decay ** episodes_started
+                    self.alpha = initial_alpha * self.decay ** episodes_started
+
+                # Periodically evaluate against fixed opponent - metrics written to the configured sink (if any)
+                if episodes_finished >= next_evaluation and episodes_finished < episodes:
+                    evaluation_schedule.evaluate(episodes_finished)
+                    next_evaluation += evaluate_every * ((episodes_finished - next_evaluation) // evaluate_every + 1)
+                evaluation_schedule.poll()
+
+        progress_bar.close()
+        run_recorder.finish()
+
+    def run_episode(self):
+        """
+        Play one game against the fixed opponent updating Q(s,a) after every action
+        """
+        if self.trace_decay > 0:
+            self._run_episode_with_traces()
+            return
+
+        _Q = self._Q
+        alpha = self.alpha
+        random_state = self.random_state
+        take_action, opponents_turn = self.environment.take_action, self.opponents_turn
+        if self._instrumentation is not None:
+            episode_instrumentation = _EpisodeInstrumentation(self._instrumentation, take_action, opponents_turn)
+            take_action, opponents_turn = episode_instrumentation.take_action, episode_instrumentation.opponents_turn
+
+        state = (0, 0, 0)
+        action = 1  # always roll at start of game
+        while action is not None:
+
+            # Take chosen action in current state
+            new_state, reward, go_again = take_action(state, action, random_state)
+
+            # If it's no longer our turn then the opponent acts as part of environment and transitions us to the
+            # next state in which it is our turn
+            if not go_again and not reward:
+                new_state, _ = opponents_turn(new_state)
+
+            # Select action from new state - will be None if new_state is terminal (won or lost)
+            new_action = self.select_e_greedy_action(new_state)
+
+            # Update Q(s,a) - Note Q(s',a') is 0 if new_state s' is terminal
+            q = _Q[state[0], state[1], state[2], action]
+            next_q = 0 if new_action is None else _Q[new_state[0], new_state[1], new_state[2], new_action]
+            _Q[state[0], state[1], state[2], action] = q + alpha * ((reward + next_q) - q)
+
+            # Increment
+            state = new_state
+            action = new_action
+
+        if self._instrumentation is not None:
+            episode_instrumentation.finish(q_updates=episode_instrumentation.steps)
+
+    def _run_episode_with_traces(self):
+        """
+        Same as run_episode but with SARSA(λ) updates - see __init__
+        """
+        _Q = self._Q
+        alpha = self.alpha
+        trace_decay = self.trace_decay
+        random_state = self.random_state
+
+        take_action, opponents_turn = self.environment.take_action, self.opponents_turn
+        if self._instrumentation is not None:
+            episode_instrumentation = _EpisodeInstrumentation(self._instrumentation, take_action, opponents_turn)
+            take_action, opponents_turn = episode_instrumentation.take_action, episode_instrumentation.opponents_turn
+        q_updates = 0
+
+        traces = {}  # (your_score, opponent_score, turn_score, action) -> eligibility
+        state = (0, 0, 0)
+        action = 1  # always roll at start of game
+        while action is not None:
+
+            new_state, reward, go_again = take_action(state, action, random_state)
+            if not go_again and not reward:
+                new_state, _ = opponents_turn(new_state)
+            new_action = self.select_e_greedy_action(new_state)
+
+            state_action = state + (action,)
+            next_q = 0 if new_action is None else _Q[new_state[0], new_state[1], new_state[2], new_action]
+            td_error = (reward + next_q) - _Q[state_action]
+
+            # Update every (s, a) with a trace - decaying traces and dropping those that become negligible
+            traces[state_action] = 1  # replacing trace
+            step = alpha * td_error
+            q_updates += len(traces)
+            for key, trace in list(traces.items()):
+                _Q[key] += step * trace
+                trace *= trace_decay
+                if trace < TRACE_CUTOFF:
+                    del traces[key]
+                else:
+                    traces[key] = trace
+
+            state = new_state
+            action = new_action
+
+        if self._instrumentation is not None:
+            episode_instrumentation.finish(q_updates=q_updates)
 
     def select_e_greedy_action(self, state):
-        if won_or_lost(state, target_score=self.environment.target_score):
+        random_state = random if self.random_state is None else self.random_state
+        if self._terminal[state]:
             action = None  # cannot sample action in terminal state
-        elif random.random() < self.eps:
-            action = random.randint(0, 1)  # random action
+        elif random_state.random() < self.eps:
+            action = random_state.randint(0, 1)  # random action
         else:
-            action = np.argmax([self.Q(state, 0), self.Q(state, 1)])  # greedy action
+            q_hold, q_roll = self._Q[state].tolist()
+            action = int(q_roll > q_hold)  # greedy action - ties go to hold as with np.argmax
         return action
 
     def opponents_turn(self, state):
         """
         The turn of the opponents is considered to be part of the environment such that at each new iteration of the
-        SARSA algorithm we are in a state where it is our turn.
+        SARSA algorithm we are in a state where it is our turn. The whole turn is sampled in one go from the opponent's
+        precomputed turn outcome distribution (see piggy.opponent_turn_cache).
         Parameters
         ----------
         state: tuple
@@ -162,47 +434,207 @@ class FixedOpponentSarsa:
         opponent_won: bool
             Whether or not the opponent has won by end of turn
         """
+        target_score = self.environment.target_score
+        outcome = self.opponent_turn_cache.sample_one(opponent_score=state[1], your_score=state[0],
+                                                      random_state=self.opponent_turn_random)
+        opponent_won = outcome == target_score
 
-        state = (state[1], state[0], 0)  # Make state from pov of opponent
-
-        go_again = True
-        opponent_won = False
-        # Opponent takes turn until it wins, rolls 1 or holds
-        while go_again and not opponent_won:
-            action = self.opponent.select_action(state)
-            state, reward, go_again = self.environment.take_action(state, action)
-            opponent_won = bool(reward)
-
-        new_state = (state[1], state[0], 0)  # Revert back to state from pov of you
+        # If the opponent won their score is set to the target so that new_state is recognised as lost
+        new_state = (state[0], target_score if opponent_won else state[1] + outcome, 0)
 
         return new_state, opponent_won
 
-    def evaluate_against_fixed_opponent(self, num_games=250):
+    def get_greedy_policy(self):
+        """
+        Returns
+        -------
+        policy: np.ndarray
+            [target_score, target_score, target_score] uint8 array - argmax of Q(s,⋅) - 1 for roll and 0 for hold
+        """
+        target_score = self.environment.target_score
+        return np.argmax(self._Q[:target_score, :target_score, :target_score], axis=3).astype(np.uint8)
+
+    def evaluate_against_fixed_opponent(self, num_games=None):
         """
         Evaluate current policy against fixed opponent to track progress
+        Parameters
+        ----------
+        num_games: int, optional
+            number of games to play - if not given the exact win probability is computed instead (which is both
+            faster and free of sampling noise)
+
         Returns
         -------
         win_rate: float
         """
-        current_policy = np.argmax(self._Q, axis=3)  # argmax along action axis gives policy array
-        agent = Agent(initial_policy=current_policy)
-        evaluator = Evaluator(self.environment, player0=agent, player1=self.opponent)
-        win_rate, _ = evaluator.evaluate(num_games=num_games)
+        agent = Agent(initial_policy=self.get_greedy_policy())
+        if num_games is None:
+            win_rate, _ = ExactEvaluator(self.environment, player0=agent, player1=self.opponent).evaluate()
+        else:
+            evaluator = Evaluator(self.environment, player0=agent, player1=self.opponent)
+            win_rate, _ = evaluator.evaluate(num_games=num_games, batch_size=num_games)
         return win_rate
 
 
+class _EvaluationSchedule:
+
+    def __init__(self, sarsa, progress_bar, background_evaluation, output_dir=None, metrics_sink=None,
+                 instrumentation=None):
+        """
+        Runs the periodic evaluations of a FixedOpponentSarsa training run - either inline or in a background process -
+        and logs their results. Use as a context manager.
+
+        Parameters
+        ----------
+        sarsa: FixedOpponentSarsa
+        progress_bar: tqdm
+        background_evaluation: bool
+        output_dir: str, optional
+            tensorboard logs are written here if no metrics_sink is given (the sink is closed at the end of the run)
+        metrics_sink: piggy.utils.metrics.MetricsSink, optional
+            flushed at the end of the run but left open
+        instrumentation: piggy.utils.instrumentation.Instrumentation, optional
+            if given - evaluations are timed (in this process) and recorded
+        """
+        self.sarsa = sarsa
+        self.instrumentation = instrumentation
+        self.progress_bar = progress_bar
+        self.metrics_sink = metrics_sink
+        self.owns_metrics_sink = metrics_sink is None and output_dir is not None
+        if self.owns_metrics_sink:
+            self.metrics_sink = TensorBoardSink(output_dir)
+
+        self.executor = None
+        if background_evaluation:
+            self.executor = ProcessPoolExecutor(max_workers=1, initializer=_set_evaluation_opponent,
+                                                initargs=(sarsa.environment, sarsa.opponent))
+        self.pending_evaluation = None  # (episode, eps, alpha, future) of the evaluation running in the background
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pending_evaluation is not None and exc_type is None:
+            self._log(*self.pending_evaluation[:3], self.pending_evaluation[3].result())
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.owns_metrics_sink:
+            self.metrics_sink.close()
+        elif self.metrics_sink is not None:
+            self.metrics_sink.flush()
+
+    def evaluate(self, episode):
+        """ Evaluate the current policy - skipped if a background evaluation is still running """
+        with maybe_timer(self.instrumentation, 'evaluation'):
+            if self.executor is None:
+                self._log(episode, self.sarsa.eps, self.sarsa.alpha, self.sarsa.evaluate_against_fixed_opponent())
+            elif self.pending_evaluation is None:
+                future = self.executor.submit(_evaluate_policy, self.sarsa.get_greedy_policy())
+                self.pending_evaluation = (episode, self.sarsa.eps, self.sarsa.alpha, future)
+
+    def poll(self):
+        """ Log the background evaluation if it has finished """
+        if self.pending_evaluation is not None and self.pending_evaluation[3].done():
+            self._log(*self.pending_evaluation[:3], self.pending_evaluation[3].result())
+            self.pending_evaluation = None
+
+    def _log(self, episode, eps, alpha, win_rate):
+        self.progress_bar.set_description('latest win rate: {:.1%} -'.format(win_rate))
+        if self.metrics_sink is not None:
+            self.metrics_sink.scalar('win rate vs fixed opponent', win_rate, step=episode)
+            self.metrics_sink.scalar('exploration rate ε', eps, step=episode)
+            self.metrics_sink.scalar('learning rate α', alpha, step=episode)
+        if self.instrumentation is not None:
+            self.instrumentation.record('evaluation', episode=episode, win_rate=win_rate, eps=eps, alpha=alpha)
+
+
+class _EpisodeInstrumentation:
+
+    def __init__(self, instrumentation, take_action, opponents_turn):
+        """
+        Counting and timing stand-ins for environment.take_action and FixedOpponentSarsa.opponents_turn - only swapped
+        into an episode when it is instrumented so that uninstrumented episodes run exactly as before
+        """
+        self.instrumentation = instrumentation
+        self._take_action = take_action
+        self._opponents_turn = opponents_turn
+        self.steps = 0
+        self.opponent_turns = 0
+        self.opponent_time = 0.0
+        self.start_time = time.perf_counter()
+
+    def take_action(self, state, action, random_state=None):
+        self.steps += 1
+        return self._take_action(state, action, random_state)
+
+    def opponents_turn(self, state):
+        self.opponent_turns += 1
+        start_time = time.perf_counter()
+        result = self._opponents_turn(state)
+        self.opponent_time += time.perf_counter() - start_time
+        return result
+
+    def finish(self, q_updates):
+        episode_time = time.perf_counter() - self.start_time
+        self.instrumentation.add_time('our turn', episode_time - self.opponent_time)
+        self.instrumentation.add_time('opponent turn', self.opponent_time)
+        self.instrumentation.count('episodes')
+        self.instrumentation.count('env steps', self.steps)
+        self.instrumentation.count('opponent turns', self.opponent_turns)
+        self.instrumentation.count('Q updates', q_updates)
+
+
+class _RunRecorder:
+
+    def __init__(self, instrumentation, method):
+        """ Records a summary of a training run once it is finished - if instrumentation is given """
+        self.instrumentation = instrumentation
+        self.method = method
+        self.start_time = time.perf_counter()
+        self.start_counters = dict(instrumentation.counters) if instrumentation is not None else None
+
+    def finish(self):
+        if self.instrumentation is None:
+            return
+        wall_time = time.perf_counter() - self.start_time
+        counters = {name: count - self.start_counters.get(name, 0)
+                    for name, count in self.instrumentation.counters.items()
+                    if count != self.start_counters.get(name, 0)}
+        self.instrumentation.record(self.method, wall_time=wall_time, counters=counters,
+                                    steps_per_second=counters.get('env steps', 0) / wall_time,
+                                    episodes_per_second=counters.get('episodes', 0) / wall_time)
+
+
+# Set in the background evaluation process by _set_evaluation_opponent
+_evaluation_environment = None
+_evaluation_opponent = None
+
+
+def _set_evaluation_opponent(environment, opponent):
+    global _evaluation_environment, _evaluation_opponent
+    _evaluation_environment, _evaluation_opponent = environment, opponent
+
+
+def _evaluate_policy(policy):
+    evaluator = ExactEvaluator(_evaluation_environment, player0=Agent(policy), player1=_evaluation_opponent)
+    win_rate, _ = evaluator.evaluate()
+    return win_rate
+
+
 if __name__ == '__main__':
 
     """ Learn optimal policy against the optimal policy using SARSA """
     from piggy.environment import Environment
+    from piggy.solution_cache import get_optimal_agent
+    from piggy.utils.metrics import JsonlSink
     from definition import ROOT_DIR
-    optimal_policy = np.load('/home/luka/PycharmProjects/Piggy/experiment_results/standard_pig_optimal_policy.npy')
-    optimal_agent = Agent(initial_policy=optimal_policy)
     env = Environment(dice_sides=6, target_score=100)
+    optimal_agent = get_optimal_agent(env)
     _sarsa = FixedOpponentSarsa(environment=env, opponent=optimal_agent, eps=0.25, alpha=0.05, decay=0.99)
 
     output_dir = create_directory_path_with_timestamp(destination_dir=os.path.join(ROOT_DIR, 'experiment_results', 'fixed_opponent_sarsa'))
-    _sarsa.run(episodes=10000, evaluate_every=10)
+    with JsonlSink(os.path.join(output_dir, 'metrics.jsonl')) as _metrics_sink:
+        _sarsa.run(episodes=10000, evaluate_every=10, metrics_sink=_metrics_sink)
 
 
 
@@ -0,0 +1,164 @@
+import hashlib
+import random
+from collections import OrderedDict
+
+import numpy as np
+
+from piggy.utils.policy_store import get_roll
+
+MAX_CACHED_OPPONENTS = 4  # each cache is [target_score]^2 x (target_score + 1) floats plus lookup tables - ~18MB at 100
+_caches = OrderedDict()  # (die kernel, target_score, policy hash) -> OpponentTurnCache - least recently used first
+
+
+def get_opponent_turn_cache(environment, opponent):
+    """
+    Returns the OpponentTurnCache for an opponent - built on first request and reused for any later request with the
+    same game and the same opponent policy (e.g. across successive FixedOpponentSarsa runs). Only the
+    MAX_CACHED_OPPONENTS most recently requested are kept - e.g. self-play requests a new one for every snapshot.
+
+    Parameters
+    ----------
+    environment: piggy.environment.Environment
+    opponent: piggy.agent.Agent
+
+    Returns
+    -------
+    cache: OpponentTurnCache
+    """
+    target_score = environment.target_score
+    roll = np.ascontiguousarray(get_roll(opponent.policy, target_score))
+    die_key = tuple(tuple(outcome) for outcome in environment.die.key())
+    key = (die_key, target_score, hashlib.sha1(roll.tobytes()).hexdigest())
+    if key in _caches:
+        _caches.move_to_end(key)
+    else:
+        _caches[key] = OpponentTurnCache(environment, opponent)
+        while len(_caches) > MAX_CACHED_OPPONENTS:
+            _caches.popitem(last=False)
+    return _caches[key]
+
+
+class OpponentTurnCache:
+
+    def __init__(self, environment, opponent, seed=None):
+        """
+        Exact distribution over the outcome of a whole turn of a fixed opponent - from the start of the turn in every
+        (opponent_score, your_score) - so that the turn can be sampled in one go rather than simulated roll by roll.
+
+        The outcome of a turn is either the number of points the opponent adds to their score (0 if they roll a 1) or
+        that they win - given index target_score.
+
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        opponent: piggy.agent.Agent
+        seed: int, optional
+            seed for the random number generators used to sample outcomes
+        """
+        self.environment = environment
+        self.opponent = opponent
+        self.rng = np.random.default_rng(seed)  # for batches of samples
+        self._random = random.Random(seed)  # for single samples - much lower overhead per call
+
+        self.outcome_probabilities = self._compute_outcome_probabilities()
+
+        # Cumulative distribution plus a guide table for each (opponent_score, your_score). guide[..., k] is the first
+        # outcome whose cumulative probability exceeds k / num_bins so sampling starts from the guide and then only
+        # has to step forward past outcomes in the same bin - O(1) expected steps.
+        self._cdf = np.cumsum(self.outcome_probabilities, axis=2)
+        self._cdf[:, :, -1] = 1  # guard against rounding leaving the total just below 1
+        self._num_bins = self._cdf.shape[2]
+        self._guide = np.empty(self._cdf.shape, dtype=np.int16)
+        for k in range(self._num_bins):
+            self._guide[:, :, k] = np.argmax(self._cdf > k / self._num_bins, axis=2)
+
+    def _compute_outcome_probabilities(self):
+        """
+        Forward pass over turn_score propagating the probability of reaching each turn score in each
+        (opponent_score, your_score) at once
+
+        Returns
+        -------
+        outcome_probabilities: np.ndarray
+            [target_score (opponent_score), target_score (your_score), target_score + 1 (outcome)]
+        """
+        target_score = self.environment.target_score
+        die = self.environment.die
+        roll = get_roll(self.opponent.policy, target_score)
+        roll[:, :, 0] = True  # always roll with a turn score of 0, as in piggy.agent.Agent
+
+        # reach[o, s, t] - probability of the opponent's turn score reaching t - padded so every roll lands inside
+        reach = np.zeros((target_score, target_score, target_score + die.max_points))
+        reach[:, :, 0] = 1
+        outcome_probabilities = np.zeros((target_score, target_score, target_score + 1))
+        opponent_score = np.arange(target_score)
+
+        for t in range(target_score):
+            playable = (opponent_score + t < target_score)[:, None]  # turn score t has already won otherwise
+            rolled = np.where(playable & roll[:, :, t], reach[:, :, t], 0)
+            outcome_probabilities[:, :, t] += np.where(playable & ~roll[:, :, t], reach[:, :, t], 0)  # hold on t
+            if die.is_uniform:  # divided rather than weighted so a fair die gives exactly the same result as ever
+                outcome_probabilities[:, :, 0] += rolled / die.num_outcomes  # rolling a 1 adds nothing
+                reach[:, :, t + die.scoring_points] += rolled[:, :, None] / die.num_outcomes
+            else:
+                outcome_probabilities[:, :, 0] += rolled * die.pig_out_probability
+                reach[:, :, t + die.scoring_points] += rolled[:, :, None] * die.scoring_probabilities
+
+        won = np.arange(reach.shape[2])[None, None, :] >= target_score - opponent_score[:, None, None]
+        outcome_probabilities[:, :, target_score] = np.where(won, reach, 0).sum(axis=2)
+        return outcome_probabilities
+
+    def seed(self, seed):
+        """
+        Reseed the random number generators used to sample outcomes
+        Parameters
+        ----------
+        seed: int
+        """
+        self.rng = np.random.default_rng(seed)
+        self._random.seed(seed)
+
+    def sample(self, opponent_score, your_score, rng=None):
+        """
+        Sample the outcome of the opponent's turn
+        Parameters
+        ----------
+        opponent_score: int or np.ndarray
+            opponent's score at the start of their turn
+        your_score: int or np.ndarray
+        rng: np.random.Generator, optional
+            defaults to the cache's own generator - pass one when the cache is shared (see get_opponent_turn_cache) so
+            that each user's samples are reproducible whatever the others do
+
+        Returns
+        -------
+        outcome: int or np.ndarray
+            points added to the opponent's score or target_score if the opponent won
+        """
+        u = (self.rng if rng is None else rng).random(np.shape(opponent_score))
+        outcome = self._guide[opponent_score, your_score, (u * self._num_bins).astype(int)]
+        not_reached = self._cdf[opponent_score, your_score, outcome] <= u
+        while np.any(not_reached):
+            outcome = outcome + not_reached
+            not_reached = self._cdf[opponent_score, your_score, outcome] <= u
+        return outcome
+
+    def sample_one(self, opponent_score, your_score, random_state=None):
+        """
+        Same as sample() for a single turn - avoids numpy call overhead which would otherwise dominate
+        Parameters
+        ----------
+        opponent_score: int
+        your_score: int
+        random_state: random.Random, optional
+            defaults to the cache's own generator - see sample()
+
+        Returns
+        -------
+        outcome: int
+        """
+        u = (self._random if random_state is None else random_state).random()
+        outcome = self._guide.item(opponent_score, your_score, int(u * self._num_bins))
+        while self._cdf.item(opponent_score, your_score, outcome) <= u:
+            outcome += 1
+        return outcome
@@ -0,0 +1,212 @@
+import os
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from piggy.utils.common import PlayableStateIndex, won, lost
+from piggy.utils.die import Die
+from piggy.utils.instrumentation import maybe_timer
+from piggy.utils.layers import backward_pass, create_padded_value_function, get_hold_scores, get_layer_rows, \
+    solve_coupled_pairs
+from piggy.utils.policy_store import get_roll, save_solution
+from definition import ROOT_DIR
+
+
+class PolicyIteration:
+
+    def __init__(self, environment, initial_policy=None, playing_piglet=False):
+        """
+        Initialize π(s) arbitrarily for each s∈ S.
+        Repeat
+            Policy evaluation - solve V(s) = Σ_s' (P(s'|s,π(s)) * [R + γV(s')]) for all s∈ S
+            Policy improvement - π(s) ← argmax_a Σ_s' (P(s'|s,a) * [R + γV(s')]) for all s∈ S
+        until π is stable
+
+        Notes -
+        - As with piggy.value_iteration.ValueIteration this is applied to disjoint subsets of states in which the sum of
+        your score and opponents score is equal, working backward from the end of the game.
+
+        - Within a layer the only cycle is between V(a,b,0) and V(b,a,0) so policy evaluation is a sparse linear system
+        that is solved exactly - a backward pass over turn_score followed by a 2x2 solve per pair - rather than by
+        repeated sweeps. Rolling with a turn score of 0 is enforced (as in piggy.agent.Agent).
+
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        initial_policy: np.ndarray, optional
+            binary array indexed by (your_score, opponent_score, turn_score) in which 1 indicates a policy of rolling and
+            0 hold e.g. from piggy.utils.create_policy - random if not given
+        playing_piglet: bool, optional
+            if True the environment's die is replaced by Die.piglet() - for pig the scoring rolls are 2-num_dice_sides
+            but for piglet rolling a head scores a 1 not a 2 (as it would if we considered a coin to be a two sided die
+            with 1 and 2 on it)
+        """
+        if environment.dice_sides == 2 and not playing_piglet:
+            print('\nWarning! - Set playing_piglet=True if you are playing with piglet rules\n')
+
+        if environment.dice_sides != 2 and playing_piglet:
+            print('\nWarning! - You have set playing_piglet=True but dice_sides={}'.format(environment.dice_sides))
+
+        self.environment = environment
+        self.playing_piglet = playing_piglet
+
+        target_score = environment.target_score
+        self.states = PlayableStateIndex(target_score=target_score)
+        self.die = Die.piglet() if playing_piglet else environment.die
+        self._V = create_padded_value_function(target_score, self.die)
+
+        self.policy = np.random.randint(0, 2, size=(target_score + 1,)*3).astype(float)
+        if initial_policy is not None:
+            self.policy[:target_score, :target_score, :target_score] = \
+                initial_policy[:target_score, :target_score, :target_score]
+
+        self.layer_stats = []  # iterations and wall time for each score_sum layer - filled in by run()
+
+    def V(self, state):
+        """
+        Getter method for value function - Returns 1 if already won, 0 if lost and V(s) otherwise.
+        Parameters
+        ----------
+        state: tuple
+
+        Returns
+        -------
+        v: float
+        """
+        if won(state, self.environment.target_score):
+            return 1
+        elif lost(state, self.environment.target_score):
+            return 0
+        else:
+            return self._V[state[0], state[1], state[2]]
+
+    def run(self, progress_callback=None, instrumentation=None):
+        """
+        Run policy iteration on each score_sum layer - starting with 2*(target-1) and working backward to 0. The
+        iterations and wall time of each layer are recorded in layer_stats.
+        Parameters
+        ----------
+        progress_callback: callable, optional
+            called with the stats of each layer (see layer_stats) as soon as it is finished
+        instrumentation: piggy.utils.instrumentation.Instrumentation, optional
+            if given - times policy evaluation and improvement, counts layers and iterations and records the stats of
+            each layer
+        """
+        self.layer_stats = []
+        progress_bar = tqdm(range(2 * (self.environment.target_score - 1), -1, -1))
+        for score_sum in progress_bar:
+
+            start_time = time.time()
+            iterations = 0
+            policy_stable = False
+            while not policy_stable:
+                with maybe_timer(instrumentation, 'evaluate policy'):
+                    self.evaluate_policy(score_sum)
+                with maybe_timer(instrumentation, 'improve policy'):
+                    policy_stable = self.improve_policy(score_sum)
+                iterations += 1
+
+            self.layer_stats.append({'score_sum': score_sum,
+                                     'iterations': iterations,
+                                     'wall_time': time.time() - start_time})
+            if instrumentation is not None:
+                instrumentation.count('layers')
+                instrumentation.count('iterations', iterations)
+                instrumentation.record('layer', **self.layer_stats[-1])
+            if progress_callback is not None:
+                progress_callback(self.layer_stats[-1])
+            progress_bar.set_description('score sum: {} - iterations: {} -'.format(score_sum, iterations))
+
+    def evaluate_policy(self, score_sum):
+        """
+        Exactly solve for the value of the current policy in every state of a layer
+        Parameters
+        ----------
+        score_sum: int
+        """
+        target_score = self.environment.target_score
+        your_score, opponent_score = get_layer_rows(score_sum, target_score)
+
+        # Holding with turn score t leaves the opponent to play from (b, a + t, 0) in a higher layer
+        hold_value = 1 - self._V[opponent_score[:, None], get_hold_scores(your_score, target_score), 0]
+
+        roll = get_roll(self.policy[your_score, opponent_score, :target_score])
+        ones = np.ones(len(your_score))
+        alpha, beta, _ = backward_pass(your_score, target_score, self.die, hold_value, pig_out_alpha=ones,
+                                       pig_out_beta=-ones, roll=roll)
+
+        # y - the value of the opponent's start-of-turn state (b, a, 0) - is V(a, b, 0) of the reversed row
+        y = solve_coupled_pairs(alpha[:, 0], beta[:, 0])[::-1]
+        self._V[your_score, opponent_score, :target_score] = alpha[:, :target_score] + beta[:, :target_score] * y[:, None]
+
+    def improve_policy(self, score_sum):
+        """
+        Act greedily w.r.t the current value function in every state of a layer - the current action is kept unless
+        the other is strictly better so that ties cannot cause the policy to cycle.
+        Parameters
+        ----------
+        score_sum: int
+
+        Returns
+        -------
+        policy_stable: bool
+        """
+        your_score, opponent_score, turn_score = self.states.layer(score_sum)
+
+        v_hold = 1 - self._V[opponent_score, your_score + turn_score, 0]
+        v_roll = self.die.roll_value(1 - self._V[opponent_score, your_score, 0],
+                                     self._V[your_score[:, None], opponent_score[:, None],
+                                             turn_score[:, None] + self.die.scoring_points])
+
+        old_policy = self.policy[your_score, opponent_score, turn_score]
+        tolerance = 1e-12  # guards against flipping between actions whose values differ only by rounding error
+        new_policy = np.where(v_roll > v_hold + tolerance, 1, np.where(v_hold > v_roll + tolerance, 0, old_policy))
+        self.policy[your_score, opponent_score, turn_score] = new_policy
+
+        return np.array_equal(new_policy, old_policy)
+
+    def get_playable_state_to_value(self):
+        """
+        Returns dict mapping each playable state to it's current estimated value
+
+        Returns
+        -------
+        state_to_value: dict
+        """
+        return {state: self.V(state) for state in self.states}
+
+    def save(self, output_dir, value_dtype=np.float64):
+        """
+        Save value function and policy - same format as piggy.value_iteration.ValueIteration.save
+        Parameters
+        ----------
+        output_dir: str
+        value_dtype: np.dtype, optional
+
+        Returns
+        -------
+        vf_filepath: str
+        policy_filepath: str
+        """
+        name = '{}_side_die__target_{}'.format(self.environment.dice_sides, self.environment.target_score)
+        return save_solution(output_dir, name, self._V, self.policy, self.environment, self.playing_piglet,
+                             value_dtype=value_dtype)
+
+
+if __name__ == '__main__':
+    """ Compare convergence from a random initial policy against starting from 'hold at 20' """
+    from piggy.environment import Environment
+    from piggy.utils.create_policy import hold_at_n_policy
+    _env = Environment(dice_sides=6, target_score=100)
+
+    for name, _initial_policy in [('random', None),
+                                  ('hold at 20', hold_at_n_policy(target_score=_env.target_score, hold_at=20))]:
+        print('Initial policy: {}'.format(name))
+        polit = PolicyIteration(environment=_env, initial_policy=_initial_policy)
+        polit.run()
+        print('Policy iteration converged in {} iterations ({:.2f}s)'.format(
+            sum(stats['iterations'] for stats in polit.layer_stats),
+            sum(stats['wall_time'] for stats in polit.layer_stats)))
+
+    polit.save(output_dir=os.path.join(ROOT_DIR, 'experiment_results'))
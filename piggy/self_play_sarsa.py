@@ -0,0 +1,220 @@
+import os
+import random
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+from tqdm import tqdm
+
+from piggy.agent import Agent
+from piggy.exact_evaluator import ExactEvaluator
+from piggy.fixed_opponent_sarsa import FixedOpponentSarsa, create_padded_Q
+from piggy.utils.policy_store import FILE_EXTENSION, save_array
+
+
+class SelfPlaySarsa:
+
+    def __init__(self, environment, eps, alpha, decay, trace_decay=0, workers=1):
+        """
+        Learn to play through self-play alone - no fixed opponent or solved policy is needed. Note the snapshot's turns
+        are still sampled from its turn outcome distribution, which is worked out from the die (see
+        piggy.opponent_turn_cache), rather than played out roll by roll.
+
+        Training runs in rounds. At the start of each round the greedy policy of the current Q is frozen as a snapshot
+        and the round's episodes are played against it with the same SARSA updates as FixedOpponentSarsa (the
+        snapshot is the fixed opponent). Episodes are split across worker processes which all update a single Q table
+        held in shared memory without locks - updates to the same entry may occasionally be lost but, as games
+        rarely visit the same states at the same moment, this barely affects learning and lets throughput scale with
+        the number of workers.
+
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        eps: float
+        alpha: float
+            learning rate
+        decay: float
+            factor by which we decay eps and alpha each episode e.g. ε' = decay * ε
+        trace_decay: float, optional
+            see FixedOpponentSarsa
+        workers: int, optional
+            number of processes to play episodes in
+        """
+        self.environment = environment
+        self.eps = eps
+        self.alpha = alpha
+        self.decay = decay
+        self.trace_decay = trace_decay
+        self.workers = workers
+
+        self.snapshot = self._random_policy()
+        self._Q, _ = create_padded_Q(environment)  # the same padded Q(s, a) as FixedOpponentSarsa
+
+        self.history = []  # episode and win rate against the reference policy at each snapshot - filled in by run()
+
+    def _random_policy(self):
+        target_score = self.environment.target_score
+        return np.random.randint(0, 2, size=(target_score,)*3).astype(np.uint8)
+
+    def _create_learner(self, snapshot):
+        return FixedOpponentSarsa(self.environment, opponent=Agent(initial_policy=snapshot), eps=self.eps,
+                                  alpha=self.alpha, decay=self.decay, trace_decay=self.trace_decay)
+
+    def get_greedy_policy(self):
+        """
+        Returns
+        -------
+        policy: np.ndarray
+            [target_score, target_score, target_score] uint8 array - argmax of Q(s,⋅) - 1 for roll and 0 for hold
+        """
+        target_score = self.environment.target_score
+        return np.argmax(self._Q[:target_score, :target_score, :target_score], axis=3).astype(np.uint8)
+
+    def run(self, episodes, snapshot_every, reference_policy=None, snapshot_dir=None, seed=None, metrics_sink=None):
+        """
+        Run self-play SARSA
+        Parameters
+        ----------
+        episodes: int
+        snapshot_every: int
+            number of episodes per round i.e. between successive snapshots of the opponent's policy
+        reference_policy: np.ndarray, optional
+            if given each snapshot is evaluated (exactly) against this policy e.g. the optimal policy
+        snapshot_dir: str, optional
+            if given each snapshot is saved here as policy__episode_{episode}.piggy (see piggy.utils.policy_store)
+        seed: int, optional
+            seed for the dice, the opponent's turns and exploration - note runs with more than one worker are not
+            reproducible as the order in which workers update Q is not
+        metrics_sink: piggy.utils.metrics.MetricsSink, optional
+            where to log the win rate against the reference policy at each snapshot
+        """
+        round_seeds = np.random.SeedSequence(seed).spawn((episodes + snapshot_every - 1) // snapshot_every)
+        shared_Q_memory = None
+        pool = None
+        try:
+            if self.workers > 1:
+                # Workers update Q in shared memory - self._Q is pointed at it for the duration of the run
+                shared_Q_memory = shared_memory.SharedMemory(create=True, size=self._Q.nbytes)
+                shared_Q = np.ndarray(self._Q.shape, self._Q.dtype, buffer=shared_Q_memory.buf)
+                shared_Q[:] = self._Q
+                self._Q = shared_Q
+                pool = Pool(processes=self.workers, initializer=_attach_shared_Q,
+                            initargs=(shared_Q_memory.name, shared_Q.shape, shared_Q.dtype))
+
+            progress_bar = tqdm(total=episodes)
+            for first_episode, round_seed in zip(range(0, episodes, snapshot_every), round_seeds):
+                self.snapshot = self.get_greedy_policy()
+                self._on_snapshot(first_episode, reference_policy, snapshot_dir, progress_bar, metrics_sink)
+
+                # Split the round's episodes between the workers
+                round_episodes = min(snapshot_every, episodes - first_episode)
+                num_tasks = min(self.workers, round_episodes)
+                task_episodes = np.diff(np.linspace(0, round_episodes, num_tasks + 1).astype(int))
+                task_first_episode = first_episode + np.concatenate([[0], np.cumsum(task_episodes)[:-1]])
+                tasks = [(self, int(task_first), int(num_task_episodes), task_seed)
+                         for task_first, num_task_episodes, task_seed
+                         in zip(task_first_episode, task_episodes, round_seed.spawn(num_tasks))]
+
+                if pool is None:
+                    for task in tasks:
+                        progress_bar.update(_play_episodes(task, self._Q))
+                else:
+                    for num_task_episodes in pool.imap_unordered(_play_episodes, tasks):
+                        progress_bar.update(num_task_episodes)
+
+            self.snapshot = self.get_greedy_policy()
+            self._on_snapshot(episodes, reference_policy, snapshot_dir, progress_bar, metrics_sink)
+            progress_bar.close()
+            if metrics_sink is not None:
+                metrics_sink.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if shared_Q_memory is not None:
+                self._Q = self._Q.copy()
+                shared_Q_memory.close()
+                shared_Q_memory.unlink()
+
+        self.eps *= self.decay ** episodes
+        self.alpha *= self.decay ** episodes
+
+    def _on_snapshot(self, episode, reference_policy, snapshot_dir, progress_bar, metrics_sink):
+        if snapshot_dir is not None:
+            file_path = os.path.join(snapshot_dir, 'policy__episode_{}{}'.format(episode, FILE_EXTENSION))
+            save_array(file_path, self.snapshot, 'policy', self.environment.dice_sides, self.environment.target_score,
+                       die=self.environment.die)
+        if reference_policy is not None:
+            win_rate = self.evaluate_against_reference(reference_policy)
+            self.history.append({'episode': episode, 'win_rate': float(win_rate)})
+            progress_bar.set_description('latest win rate: {:.1%} -'.format(win_rate))
+            if metrics_sink is not None:
+                metrics_sink.scalar('win rate vs reference', win_rate, step=episode)
+
+    def evaluate_against_reference(self, reference_policy):
+        """
+        Exact win probability of the current greedy policy against a reference policy
+        Parameters
+        ----------
+        reference_policy: np.ndarray
+
+        Returns
+        -------
+        win_rate: float
+        """
+        evaluator = ExactEvaluator(self.environment, player0=Agent(initial_policy=self.get_greedy_policy()),
+                                   player1=Agent(initial_policy=reference_policy))
+        win_rate, _ = evaluator.evaluate()
+        return win_rate
+
+    def __getstate__(self):
+        # Tasks sent to workers only need the settings and the snapshot - workers attach to Q in shared memory
+        state = self.__dict__.copy()
+        state['_Q'] = None
+        state['history'] = []
+        return state
+
+
+# Set in each worker process by _attach_shared_Q - the shared memory is kept open for the life of the worker
+_worker_Q_memory = None
+_worker_Q = None
+
+
+def _attach_shared_Q(shared_memory_name, shape, dtype):
+    global _worker_Q_memory, _worker_Q
+    _worker_Q_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    _worker_Q = np.ndarray(shape, dtype, buffer=_worker_Q_memory.buf)
+
+
+def _play_episodes(task, Q=None):
+    """
+    Play a task's episodes against the snapshot - updating Q in place (the worker's shared Q if not given)
+    """
+    self_play, first_episode, num_episodes, seed = task
+    learner = self_play._create_learner(self_play.snapshot)
+    learner._Q = _worker_Q if Q is None else Q
+    learner.eps = self_play.eps * self_play.decay ** first_episode
+    learner.alpha = self_play.alpha * self_play.decay ** first_episode
+
+    # The learner's own generators for the dice and exploration and for the opponent's turns - the global random
+    # module is left alone
+    dice_seed, opponent_seed = seed.generate_state(2)
+    learner.random_state = random.Random(int(dice_seed))
+    learner.opponent_turn_random.seed(int(opponent_seed))
+
+    for _ in range(num_episodes):
+        learner.run_episode()
+        learner.eps *= learner.decay
+        learner.alpha *= learner.decay
+    return num_episodes
+
+
+if __name__ == '__main__':
+    """ Learn to play through self-play - tracking the win rate against the optimal policy """
+    from piggy.environment import Environment
+    from piggy.solution_cache import get_solution
+    env = Environment(dice_sides=6, target_score=100)
+    _, _optimal_policy = get_solution(dice_sides=env.dice_sides, target_score=env.target_score)
+
+    _self_play = SelfPlaySarsa(environment=env, eps=0.2, alpha=0.1, decay=0.999995, trace_decay=0.9,
+                               workers=os.cpu_count())
+    _self_play.run(episodes=1000000, snapshot_every=50000, reference_policy=_optimal_policy, seed=0)
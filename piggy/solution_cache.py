@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from piggy.agent import Agent
+from piggy.environment import Environment
+from piggy.utils.die import Die
+from piggy.utils.policy_store import FILE_EXTENSION, get_die_key, load_array
+from definition import ROOT_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+""" Local cache of solved games - value function and optimal policy of each variant, solved at most once
+
+Entries are keyed on (dice_sides, target_score, playing_piglet, solver, eps - plus the die if it isn't a fair one) and
+live in a directory named by the hash of that key. Each entry is written to a temporary directory and renamed into
+place once complete, under a per-entry file lock, so concurrent processes asking for the same variant wait for one of
+them to solve it rather than solving it twice. Once the cache grows past its size limit the least recently used
+entries are evicted.
+"""
+
+DEFAULT_CACHE_DIR = os.environ.get('PIGGY_CACHE_DIR', os.path.join(ROOT_DIR, 'experiment_results', 'solution_cache'))
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+SOLVERS = ('value_iteration', 'value_iteration_exact', 'policy_iteration')
+_KEY_FILE_NAME = 'key.json'  # written last - an entry is complete once it exists
+
+
+def get_solution(dice_sides, target_score, playing_piglet=False, solver='value_iteration_exact', eps=None,
+                 cache_dir=DEFAULT_CACHE_DIR, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES, faces=None):
+    """
+    Returns the solved value function and optimal policy of a game - solving it first if it isn't already cached
+    Parameters
+    ----------
+    dice_sides: int
+    target_score: int
+    playing_piglet: bool, optional
+    solver: str, optional
+        'value_iteration' (requires eps), 'value_iteration_exact' or 'policy_iteration' - the last two are exact so
+        eps is ignored
+    eps: float, optional
+        convergence threshold for 'value_iteration'
+    cache_dir: str, optional
+        defaults to $PIGGY_CACHE_DIR or experiment_results/solution_cache
+    max_cache_bytes: int, optional
+        size above which least recently used entries are evicted
+    faces: dict, optional
+        face -> (probability, points) of a biased or non-standard die - see piggy.environment.Environment
+
+    Returns
+    -------
+    V: np.ndarray
+        [target_score + 1]^3 memory-mapped value function - see piggy.utils.policy_store
+    policy: np.ndarray
+        [target_score]^3 memory-mapped uint8 policy - 1 for roll, 0 for hold
+    """
+    entry_dir = get_entry_dir(dice_sides, target_score, playing_piglet, solver, eps, cache_dir, faces)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with _FileLock(entry_dir + '.lock'):
+        if not os.path.exists(os.path.join(entry_dir, _KEY_FILE_NAME)):
+            _solve_into(entry_dir, dice_sides, target_score, playing_piglet, solver, eps, faces)
+        os.utime(os.path.join(entry_dir, _KEY_FILE_NAME))  # mark as recently used
+
+        # Memory maps stay valid even if the entry is evicted by another process afterwards (except on Windows, where
+        # the eviction of an open entry fails and is retried next time)
+        V, _ = load_array(os.path.join(entry_dir, 'value_func' + FILE_EXTENSION))
+        policy, _ = load_array(os.path.join(entry_dir, 'policy' + FILE_EXTENSION))
+
+    evict(cache_dir, max_cache_bytes, keep=entry_dir)
+    return V, policy
+
+
+def get_optimal_agent(environment, playing_piglet=False, **kwargs):
+    """
+    Agent playing the optimal policy of a game - see get_solution
+    Parameters
+    ----------
+    environment: piggy.environment.Environment
+    playing_piglet: bool, optional
+    kwargs:
+        passed to get_solution
+
+    Returns
+    -------
+    agent: piggy.agent.Agent
+    """
+    _, policy = get_solution(environment.dice_sides, environment.target_score, playing_piglet, faces=environment.faces,
+                             **kwargs)
+    return Agent(initial_policy=policy)
+
+
+def get_entry_dir(dice_sides, target_score, playing_piglet, solver, eps, cache_dir=DEFAULT_CACHE_DIR, faces=None):
+    """
+    Returns the directory a variant is cached in
+
+    Returns
+    -------
+    entry_dir: str
+    """
+    key = _get_key(dice_sides, target_score, playing_piglet, solver, eps, faces)
+    key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key_hash)
+
+
+def evict(cache_dir, max_cache_bytes, keep=None):
+    """
+    Remove least recently used entries until the cache is no larger than max_cache_bytes
+    Parameters
+    ----------
+    cache_dir: str
+    max_cache_bytes: int
+    keep: str, optional
+        entry directory that is never evicted
+    """
+    with _FileLock(os.path.join(cache_dir, 'eviction.lock')):
+        entries = []
+        for name in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir, name)
+            key_file_path = os.path.join(entry_dir, _KEY_FILE_NAME)
+            if os.path.isdir(entry_dir) and os.path.exists(key_file_path):
+                size = sum(os.path.getsize(os.path.join(entry_dir, file_name)) for file_name in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(key_file_path), size, entry_dir))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= max_cache_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            with _FileLock(entry_dir + '.lock') as entry_lock:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                entry_lock.remove()  # so lock files don't outlive their entries
+            if not os.path.exists(entry_dir):
+                total_size -= size
+
+
+def _get_key(dice_sides, target_score, playing_piglet, solver, eps, faces=None):
+    if solver not in SOLVERS:
+        raise ValueError('Unknown solver: {}'.format(solver))
+    if solver == 'value_iteration':
+        if eps is None:
+            raise ValueError('eps is required for value_iteration')
+        eps = float(eps)
+    else:
+        eps = None  # exact solvers - eps doesn't change the result
+    key = {'dice_sides': int(dice_sides if faces is None else len(faces)),
+           'target_score': int(target_score),
+           'playing_piglet': bool(playing_piglet),
+           'solver': solver,
+           'eps': eps}
+    die_key = get_die_key(Die(faces), key['dice_sides']) if faces is not None else None
+    if die_key is not None:  # fair dice keep the keys they had before any other die could be played
+        key['die'] = die_key
+    return key
+
+
+def _solve_into(entry_dir, dice_sides, target_score, playing_piglet, solver, eps, faces=None):
+    from piggy.policy_iteration import PolicyIteration
+    from piggy.value_iteration import ValueIteration
+
+    environment = Environment(dice_sides=dice_sides, target_score=target_score, faces=faces)
+    if solver == 'policy_iteration':
+        solution = PolicyIteration(environment=environment, playing_piglet=playing_piglet)
+        solution.run()
+    else:
+        solution = ValueIteration(environment=environment, eps=eps, playing_piglet=playing_piglet)
+        solution.run(engine='numpy' if solver == 'value_iteration' else 'exact')
+
+    # Written to a temporary directory and renamed into place - only a complete entry is ever visible
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    try:
+        vf_filepath, policy_filepath = solution.save(temp_dir)
+        os.replace(vf_filepath, os.path.join(temp_dir, 'value_func' + FILE_EXTENSION))
+        os.replace(policy_filepath, os.path.join(temp_dir, 'policy' + FILE_EXTENSION))
+        key = _get_key(dice_sides, target_score, playing_piglet, solver, eps, faces)
+        key['saved_at'] = time.time()
+        with open(os.path.join(temp_dir, _KEY_FILE_NAME), 'w', encoding='utf-8') as key_file:
+            json.dump(key, key_file, sort_keys=True, indent=4)
+        shutil.rmtree(entry_dir, ignore_errors=True)  # incomplete entry left by a process that died mid-write
+        os.replace(temp_dir, entry_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+
+class _FileLock:
+
+    def __init__(self, file_path):
+        """ Exclusive lock on a file - held between processes for the duration of a with block """
+        self.file_path = file_path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.file_path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            # If the lock file was removed (see remove) while waiting for it then the lock is on a file no other
+            # process can open - start again with the file now at file_path
+            while not self._is_current():
+                self._file.close()
+                self._file = open(self.file_path, 'a+')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds
+                    pass
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+
+    def remove(self):
+        """ Delete the lock file while holding it - processes waiting on it then lock a new one """
+        try:
+            os.remove(self.file_path)
+        except OSError:  # e.g. Windows, where an open file can't be deleted - left for next time
+            pass
+
+    def _is_current(self):
+        try:
+            return os.stat(self.file_path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from piggy.utils.die import Die
+from piggy.utils.layers import get_hold_scores, get_layer_rows, solve_layer_newton
+from piggy.utils.policy_store import FILE_EXTENSION, create_array, load_array
+from definition import ROOT_DIR
+
+
+class StreamingValueIteration:
+
+    def __init__(self, environment, output_dir, playing_piglet=False, max_memory_bytes=256 * 1024 ** 2,
+                 value_dtype=np.float64):
+        """
+        Memory-bounded counterpart to ValueIteration(...).run(engine='exact') for targets whose value function doesn't
+        fit in memory (target 1000 has 1e9 states).
+
+        Layers are solved from the highest score_sum down exactly as in the exact engine, but solving layer k only
+        needs the start-of-turn values V(a, b, 0) of higher layers (through holding) - a [target + 1, target + 1]
+        array - plus the layer itself. So only that array and the rows of the layer being solved are held in memory.
+        Each finished layer is streamed to the value function and policy files (see piggy.utils.policy_store) which
+        can then be memory-mapped like any other solution.
+
+        A layer's rows are solved in chunks if need be so that memory use stays within max_memory_bytes - each chunk
+        holds whole V(a, b, ⋅) / V(b, a, ⋅) pairs of rows as those are coupled through rolling a 1.
+
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        output_dir: str
+        playing_piglet: bool, optional
+            see piggy.value_iteration.ValueIteration
+        max_memory_bytes: int, optional
+            bound on the memory used for solving (excluding the interpreter and numpy themselves)
+        value_dtype: np.dtype, optional
+            float64 (default) or float32 - dtype of the value function file
+        """
+        self.environment = environment
+        self.output_dir = output_dir
+        self.playing_piglet = playing_piglet
+        self.max_memory_bytes = max_memory_bytes
+        self.value_dtype = np.dtype(value_dtype)
+        self.die = Die.piglet() if playing_piglet else environment.die
+
+        name = '{}_side_die__target_{}'.format(environment.dice_sides, environment.target_score)
+        self.vf_filepath = os.path.join(output_dir, 'value_func__' + name + FILE_EXTENSION)
+        self.policy_filepath = os.path.join(output_dir, 'policy__' + name + FILE_EXTENSION)
+
+        # V(a, b, 0) for every a, b - won if a = target and lost if b = target
+        target_score = environment.target_score
+        self.start_of_turn_values = np.zeros((target_score + 1, target_score + 1))
+        self.start_of_turn_values[target_score, :] = 1
+
+        self.max_rows_per_chunk = self._get_max_rows_per_chunk()
+
+    def _get_max_rows_per_chunk(self):
+        """
+        Largest (even) number of rows that can be solved at once within max_memory_bytes
+        """
+        target_score = self.environment.target_score
+        num_columns = target_score + self.die.max_points
+
+        # Per row - α and β inside backward_pass and the copies it returns, the value/policy rows written out, the
+        # hold values and the greedy policy (generously rounded up to cover numpy temporaries)
+        bytes_per_row = 8 * (8 * num_columns + 4 * target_score)
+        available_bytes = self.max_memory_bytes - self.start_of_turn_values.nbytes
+        max_rows = 2 * (available_bytes // (2 * bytes_per_row))
+        if max_rows < 2:
+            raise ValueError('max_memory_bytes of {} is too small for target {} - at least {} bytes are needed'.format(
+                self.max_memory_bytes, target_score, self.start_of_turn_values.nbytes + 2 * bytes_per_row))
+        return max_rows
+
+    def run(self):
+        """
+        Solve every layer - starting with score_sum 2*(target-1) and working backward to 0 - writing each to the output
+        files as it is finished
+        """
+        target_score = self.environment.target_score
+        os.makedirs(self.output_dir, exist_ok=True)
+        vf_metadata = create_array(self.vf_filepath, (target_score + 1,)*3, 'value_func', self.environment.dice_sides,
+                                   target_score, self.playing_piglet, dtype=self.value_dtype, die=self.environment.die)
+        policy_metadata = create_array(self.policy_filepath, (target_score,)*3, 'policy', self.environment.dice_sides,
+                                       target_score, self.playing_piglet, die=self.environment.die)
+
+        with open(self.vf_filepath, 'r+b') as vf_file, open(self.policy_filepath, 'r+b') as policy_file:
+            self._vf_file, self._vf_offset = vf_file, vf_metadata['offset']
+            self._policy_file, self._policy_offset = policy_file, policy_metadata['offset']
+
+            # Rows in which either player has already reached the target are terminal
+            turn_score = np.arange(target_score + 1)
+            for score in range(target_score + 1):
+                self._write_value_row(target_score, score, np.ones(target_score + 1))
+                if score < target_score:
+                    self._write_value_row(score, target_score, (score + turn_score >= target_score).astype(float))
+
+            for score_sum in tqdm(range(2 * (target_score - 1), -1, -1)):
+                your_score, opponent_score = get_layer_rows(score_sum, target_score)
+                for chunk in self._get_row_chunks(len(your_score)):
+                    self._solve_rows(your_score[chunk], opponent_score[chunk])
+
+    def _get_row_chunks(self, num_rows):
+        """
+        Split a layer's rows into chunks of at most max_rows_per_chunk - each chunk is symmetric (row i is in the same
+        chunk as its coupled row num_rows - 1 - i) and in ascending order, as backward_pass requires
+        """
+        num_pairs = (num_rows + 1) // 2
+        pairs_per_chunk = self.max_rows_per_chunk // 2
+        for start in range(0, num_pairs, pairs_per_chunk):
+            first_half = np.arange(start, min(start + pairs_per_chunk, num_pairs))
+            yield np.unique(np.concatenate([first_half, num_rows - 1 - first_half]))
+
+    def _solve_rows(self, your_score, opponent_score):
+        """
+        Newton iteration on the coupling between pairs of rows, as in ValueIteration._run_exact - see
+        piggy.utils.layers.solve_layer_newton
+        """
+        target_score = self.environment.target_score
+        turn_score = np.arange(target_score)
+
+        hold_value = 1 - self.start_of_turn_values[opponent_score[:, None], get_hold_scores(your_score, target_score)]
+        ones = np.ones(len(your_score))
+
+        y = np.full(len(your_score), 0.5)  # initial guess for V(b,a,0) of each row
+        alpha, beta, roll, y, _ = solve_layer_newton(your_score, target_score, self.die, hold_value, pig_out_alpha=ones,
+                                                     pig_out_beta=-ones, coupling_value=y)
+
+        values = alpha[:, :target_score + 1] + beta[:, :target_score + 1] * y[:, None]  # won cells have α=1, β=0
+        self.start_of_turn_values[your_score, opponent_score] = values[:, 0]
+
+        playable = your_score[:, None] + turn_score[None, :] < target_score
+        for row, (a, b) in enumerate(zip(your_score, opponent_score)):
+            self._write_value_row(a, b, values[row])
+            self._write_policy_row(a, b, roll[row] & playable[row])
+
+    def _write_value_row(self, your_score, opponent_score, values):
+        target_score = self.environment.target_score
+        row_bytes = (target_score + 1) * self.value_dtype.itemsize
+        self._vf_file.seek(self._vf_offset + (your_score * (target_score + 1) + opponent_score) * row_bytes)
+        self._vf_file.write(values.astype(self.value_dtype).tobytes())
+
+    def _write_policy_row(self, your_score, opponent_score, roll):
+        target_score = self.environment.target_score
+        self._policy_file.seek(self._policy_offset + (your_score * target_score + opponent_score) * target_score)
+        self._policy_file.write(roll.astype(np.uint8).tobytes())
+
+    def load(self):
+        """
+        Memory-map the solution - only valid after run()
+
+        Returns
+        -------
+        V: np.ndarray
+            [target_score + 1]^3
+        policy: np.ndarray
+            [target_score]^3 uint8
+        """
+        V, _ = load_array(self.vf_filepath, environment=self.environment)
+        policy, _ = load_array(self.policy_filepath, environment=self.environment)
+        return V, policy
+
+
+if __name__ == '__main__':
+    """ Solve pig to 1000 in under 256MB """
+    from piggy.environment import Environment
+    _env = Environment(dice_sides=6, target_score=1000)
+    streaming_value_iteration = StreamingValueIteration(environment=_env,
+                                                        output_dir=os.path.join(ROOT_DIR, 'experiment_results'),
+                                                        value_dtype=np.float32)
+    streaming_value_iteration.run()
+    print('Win probability of the starting player: {:.4f}'.format(streaming_value_iteration.start_of_turn_values[0, 0]))
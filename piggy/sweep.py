@@ -0,0 +1,192 @@
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Manager
+
+from tqdm import tqdm
+
+from piggy.environment import Environment
+from piggy.solution_cache import SOLVERS
+from piggy.utils.create_policy import hold_at_n_policy
+from definition import ROOT_DIR
+
+SUMMARY_COLUMNS = ['name', 'dice_sides', 'target_score', 'playing_piglet', 'solver', 'eps', 'initial_policy',
+                   'layers', 'total_sweeps', 'final_delta', 'wall_time', 'start_win_probability']
+
+
+def get_grid(dice_sides, target_scores, playing_piglet=(False,), solvers=('value_iteration',), eps=(1e-6,),
+             initial_policies=(None,)):
+    """
+    Every combination of the given settings - skipping combinations that don't make sense (piglet needs a 2 sided
+    die, only value iteration uses eps and only policy iteration uses an initial policy)
+    Parameters
+    ----------
+    dice_sides: iterable
+    target_scores: iterable
+    playing_piglet: iterable, optional
+    solvers: iterable, optional
+        'value_iteration', 'value_iteration_exact' or 'policy_iteration'
+    eps: iterable, optional
+    initial_policies: iterable, optional
+        None (random), 'random' or 'hold_at_{n}'
+
+    Returns
+    -------
+    configs: list
+        list of dicts - one per variant
+    """
+    configs = []
+    for config in itertools.product(dice_sides, target_scores, playing_piglet, solvers, eps, initial_policies):
+        config = dict(zip(['dice_sides', 'target_score', 'playing_piglet', 'solver', 'eps', 'initial_policy'], config))
+        if config['playing_piglet'] and config['dice_sides'] != 2:
+            continue
+        if config['solver'] not in SOLVERS:
+            raise ValueError('Unknown solver: {}'.format(config['solver']))
+        if config['solver'] != 'value_iteration':
+            config['eps'] = None
+        if config['solver'] != 'policy_iteration':
+            config['initial_policy'] = None
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def get_name(config):
+    """ Name of a variant - used for its output directory """
+    name = '{}_side_die__target_{}'.format(config['dice_sides'], config['target_score'])
+    if config['playing_piglet']:
+        name += '__piglet'
+    name += '__' + config['solver']
+    if config['eps'] is not None:
+        name += '__eps_{:g}'.format(config['eps'])
+    if config['initial_policy'] is not None:
+        name += '__from_{}'.format(config['initial_policy'])
+    return name
+
+
+def run_sweep(configs, output_dir, workers=None):
+    """
+    Solve every variant - in parallel, largest first - saving each solution (see the solvers' save()) to its own
+    directory in output_dir and writing a summary table to output_dir/summary.csv
+    Parameters
+    ----------
+    configs: list
+        e.g. from get_grid
+    output_dir: str
+    workers: int, optional
+        number of processes - defaults to os.cpu_count()
+
+    Returns
+    -------
+    summary: list
+        dict for each variant (in the order of configs) with SUMMARY_COLUMNS
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+
+    # The number of states grows with target^3 - start the largest jobs first so they don't hold up the end of the sweep
+    order = sorted(range(len(configs)), key=lambda i: _get_cost(configs[i]), reverse=True)
+    total_layers = sum(2 * configs[i]['target_score'] - 1 for i in order)
+
+    summary = [None] * len(configs)
+    with Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+        progress_queue = manager.Queue()  # (variant index, layer stats) sent by workers as each layer is finished
+        futures = {executor.submit(_solve, i, configs[i], output_dir, progress_queue): i for i in order}
+
+        layers_done = {i: 0 for i in order}
+        with tqdm(total=total_layers) as progress_bar:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                while not progress_queue.empty():
+                    i, layer_stats = progress_queue.get()
+                    layers_done[i] += 1
+                    progress_bar.update(1)
+                    progress_bar.set_description('{} - score sum {} -'.format(get_name(configs[i]),
+                                                                            layer_stats['score_sum']))
+                for future in done:
+                    i = futures[future]
+                    summary[i] = future.result()
+                    progress_bar.update(2 * configs[i]['target_score'] - 1 - layers_done[i])  # in case any were missed
+                    layers_done[i] = 2 * configs[i]['target_score'] - 1
+
+    with open(os.path.join(output_dir, 'summary.csv'), 'w', encoding='utf-8', newline='') as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(summary)
+    print_summary(summary)
+    return summary
+
+
+def print_summary(summary):
+    """
+    Parameters
+    ----------
+    summary: list
+        from run_sweep
+    """
+    print('{:<70} {:>8} {:>14} {:>12} {:>12}'.format('variant', 'layers', 'total sweeps', 'final delta', 'wall time'))
+    for row in summary:
+        print('{:<70} {:>8} {:>14} {:>12.2e} {:>11.2f}s'.format(row['name'], row['layers'], row['total_sweeps'],
+                                                                row['final_delta'], row['wall_time']))
+
+
+def _get_cost(config):
+    return config['target_score'] ** 3 * (config['dice_sides'] - 1)
+
+
+def _solve(index, config, output_dir, progress_queue):
+    from piggy.policy_iteration import PolicyIteration
+    from piggy.value_iteration import ValueIteration
+
+    environment = Environment(dice_sides=config['dice_sides'], target_score=config['target_score'])
+    progress_callback = lambda layer_stats: progress_queue.put((index, layer_stats))  # noqa: E731
+
+    start_time = time.time()
+    if config['solver'] == 'policy_iteration':
+        solver = PolicyIteration(environment=environment,
+                                 initial_policy=_get_initial_policy(config['initial_policy'], config['target_score']),
+                                 playing_piglet=config['playing_piglet'])
+        solver.run(progress_callback=progress_callback)
+        total_sweeps = sum(stats['iterations'] for stats in solver.layer_stats)
+        final_delta = 0.0  # each policy evaluation is exact
+    else:
+        solver = ValueIteration(environment=environment, eps=config['eps'], playing_piglet=config['playing_piglet'])
+        solver.run(engine='numpy' if config['solver'] == 'value_iteration' else 'exact',
+                   progress_callback=progress_callback)
+        total_sweeps = sum(stats['sweeps'] for stats in solver.layer_stats)
+        final_delta = max(stats['delta'] for stats in solver.layer_stats)
+    wall_time = time.time() - start_time
+
+    name = get_name(config)
+    variant_dir = os.path.join(output_dir, name)
+    os.makedirs(variant_dir, exist_ok=True)
+    solver.save(variant_dir)
+
+    row = {'name': name, **config,
+           'layers': len(solver.layer_stats),
+           'total_sweeps': total_sweeps,
+           'final_delta': final_delta,
+           'wall_time': wall_time,
+           'start_win_probability': float(solver.V((0, 0, 0)))}
+    return row
+
+
+def _get_initial_policy(initial_policy, target_score):
+    if initial_policy is None or initial_policy == 'random':
+        return None
+    if initial_policy.startswith('hold_at_'):
+        return hold_at_n_policy(target_score=target_score, hold_at=int(initial_policy[len('hold_at_'):]))
+    raise ValueError('Unknown initial policy: {}'.format(initial_policy))
+
+
+if __name__ == '__main__':
+    """ Convergence of value iteration and policy iteration across dice and targets """
+    from piggy.utils.io import create_directory_path_with_timestamp
+    _configs = get_grid(dice_sides=[4, 6, 8], target_scores=[50, 100], solvers=['value_iteration', 'policy_iteration'],
+                        eps=[1e-6], initial_policies=['random', 'hold_at_20'])
+    _configs += get_grid(dice_sides=[2], target_scores=[50, 100], playing_piglet=[True])
+    run_sweep(_configs, output_dir=create_directory_path_with_timestamp(
+        destination_dir=os.path.join(ROOT_DIR, 'experiment_results', 'sweeps')))
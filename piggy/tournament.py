@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from piggy.agent import Agent
+from piggy.evaluator import Evaluator
+from piggy.exact_evaluator import ExactEvaluator
+from piggy.utils.policy_store import get_die_key, get_roll
+from definition import ROOT_DIR
+
+""" Round-robin tournaments between policies
+
+Every pair of policies plays one matchup - exactly (see piggy.exact_evaluator) for targets up to
+EXACT_MAX_TARGET_SCORE and by sequential simulation (see piggy.evaluator.Evaluator.evaluate_sequential) above that -
+spread across processes. Each result is cached on disk keyed on the hashes of the two policies and the game variant, so
+adding a policy to a tournament only plays that policy's matchups.
+"""
+
+DEFAULT_CACHE_DIR = os.environ.get('PIGGY_TOURNAMENT_CACHE_DIR',
+                                   os.path.join(ROOT_DIR, 'experiment_results', 'tournament_cache'))
+EXACT_MAX_TARGET_SCORE = 300  # the exact evaluation of a matchup grows with target^3 - simulate above this
+
+
+class Tournament:
+
+    def __init__(self, environment, policies, method='auto', ci_width=0.005, seed=0, cache_dir=DEFAULT_CACHE_DIR,
+                 workers=None):
+        """
+        Parameters
+        ----------
+        environment: piggy.environment.Environment
+        policies: dict
+            name -> [target_score, target_score, target_score] policy array (or piggy.agent.Agent)
+        method: str, optional
+            'exact', 'simulate' or 'auto' (exact up to EXACT_MAX_TARGET_SCORE)
+        ci_width: float, optional
+            width of the 95% confidence interval each simulated matchup is played to
+        seed: int, optional
+            seed of the simulated matchups
+        cache_dir: str, optional
+            defaults to $PIGGY_TOURNAMENT_CACHE_DIR or experiment_results/tournament_cache
+        workers: int, optional
+            number of processes - defaults to os.cpu_count()
+        """
+        if method not in ('auto', 'exact', 'simulate'):
+            raise ValueError('Unknown method: {}'.format(method))
+        if method == 'auto':
+            method = 'exact' if environment.target_score <= EXACT_MAX_TARGET_SCORE else 'simulate'
+
+        self.environment = environment
+        self.names = list(policies)
+        self.policies = [_normalise_policy(policy.policy if isinstance(policy, Agent) else policy,
+                                           environment.target_score) for policy in policies.values()]
+        self.policy_hashes = [hashlib.sha1(policy.tobytes()).hexdigest() for policy in self.policies]
+        self.method = method
+        self.ci_width = ci_width
+        self.seed = seed
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count()
+
+        self.win_matrix = None  # [i, j] - probability that policy i beats policy j (each equally likely to start)
+
+    def run(self):
+        """
+        Play every matchup that isn't already cached
+
+        Returns
+        -------
+        win_matrix: np.ndarray
+            [num_policies, num_policies] - entry [i, j] is the probability that policy i beats policy j
+        """
+        num_policies = len(self.policies)
+        win_matrix = np.full((num_policies, num_policies), 0.5)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        to_play = []
+        for i in range(num_policies):
+            for j in range(i + 1, num_policies):
+                win_probability = self._read_cache(i, j)
+                if win_probability is None:
+                    to_play.append((i, j))
+                else:
+                    win_matrix[i, j], win_matrix[j, i] = win_probability, 1 - win_probability
+
+        if to_play:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_set_tournament,
+                                     initargs=(self.environment, self.policies, self.method, self.ci_width,
+                                               self.seed)) as executor:
+                futures = {executor.submit(_play_matchup, i, j): (i, j) for i, j in to_play}
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    i, j = futures[future]
+                    win_probability = future.result()
+                    win_matrix[i, j], win_matrix[j, i] = win_probability, 1 - win_probability
+                    self._write_cache(i, j, win_probability)
+
+        self.win_matrix = win_matrix
+        return win_matrix
+
+    def ranking(self):
+        """
+        Policies ranked by their mean win probability against all of the others - only valid after run()
+
+        Returns
+        -------
+        ranking: list
+            (name, mean win probability) - best first
+        """
+        num_policies = len(self.names)
+        others = ~np.eye(num_policies, dtype=bool)
+        mean_win_probability = (self.win_matrix * others).sum(axis=1) / max(num_policies - 1, 1)
+        order = np.argsort(-mean_win_probability, kind='stable')
+        return [(self.names[i], float(mean_win_probability[i])) for i in order]
+
+    def print_results(self):
+        """ Print the ranking and win matrix (rows and columns in ranked order) - only valid after run() """
+        ranking = self.ranking()
+        order = [self.names.index(name) for name, _ in ranking]
+        width = max(len(name) for name in self.names) + 6  # room for the rank prefix of the matrix's row labels
+
+        print('{:<6}{:<{width}}{:>10}'.format('rank', 'policy', 'mean win', width=width))
+        for rank, (name, mean_win_probability) in enumerate(ranking, start=1):
+            print('{:<6}{:<{width}}{:>10.2%}'.format(rank, name, mean_win_probability, width=width))
+
+        print('\nP(row beats column)')
+        print(' ' * width + ''.join('{:>8}'.format(rank) for rank in range(1, len(order) + 1)))
+        for rank, i in enumerate(order, start=1):
+            print('{:<{width}}'.format('{}. {}'.format(rank, self.names[i]), width=width) +
+                  ''.join('{:>8}'.format('-' if i == j else '{:.1%}'.format(self.win_matrix[i, j])) for j in order))
+
+    def _get_cache_path(self, i, j):
+        """ Cache file of a matchup - and whether i and j are swapped in it (its key is in order of policy hash) """
+        swapped = self.policy_hashes[i] > self.policy_hashes[j]
+        first, second = (j, i) if swapped else (i, j)
+        key = {'player0': self.policy_hashes[first],
+               'player1': self.policy_hashes[second],
+               'dice_sides': self.environment.dice_sides,
+               'target_score': self.environment.target_score,
+               'method': self.method}
+        die_key = get_die_key(self.environment.die, self.environment.dice_sides)
+        if die_key is not None:
+            key['die'] = die_key
+        if self.method == 'simulate':
+            key.update(ci_width=self.ci_width, seed=self.seed)
+        key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key_hash + '.json'), swapped
+
+    def _read_cache(self, i, j):
+        cache_path, swapped = self._get_cache_path(i, j)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, 'r', encoding='utf-8') as cache_file:
+            win_probability = json.load(cache_file)['player0_win_probability']
+        return 1 - win_probability if swapped else win_probability
+
+    def _write_cache(self, i, j, win_probability):
+        # Written to a temporary file and renamed into place so concurrent tournaments never see a partial result
+        cache_path, swapped = self._get_cache_path(i, j)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as cache_file:
+            json.dump({'player0_win_probability': 1 - win_probability if swapped else win_probability}, cache_file)
+        os.replace(temp_path, cache_path)
+
+
+def _normalise_policy(policy, target_score):
+    """
+    Policy as a uint8 array in which every cell that cannot affect play is fixed (rolling with a turn score of 0, as
+    in piggy.agent.Agent, and holding where the turn score has already won) - so policies that play the same hash
+    the same.
+    """
+    policy = get_roll(policy, target_score)
+    your_score, _, turn_score = np.indices(policy.shape, sparse=True)
+    policy = policy & (your_score + turn_score < target_score)
+    policy[:, :, 0] = True
+    return policy.astype(np.uint8)
+
+
+# Set in each worker process by _set_tournament
+_tournament_environment = None
+_tournament_policies = None
+_tournament_method = None
+_tournament_ci_width = None
+_tournament_seed = None
+
+
+def _set_tournament(environment, policies, method, ci_width, seed):
+    global _tournament_environment, _tournament_policies, _tournament_method, _tournament_ci_width, _tournament_seed
+    _tournament_environment, _tournament_policies = environment, policies
+    _tournament_method, _tournament_ci_width, _tournament_seed = method, ci_width, seed
+
+
+def _play_matchup(i, j):
+    player0, player1 = Agent(_tournament_policies[i]), Agent(_tournament_policies[j])
+    if _tournament_method == 'exact':
+        win_probability, _ = ExactEvaluator(_tournament_environment, player0, player1).evaluate()
+    else:
+        evaluator = Evaluator(_tournament_environment, player0, player1)
+        result = evaluator.evaluate_sequential(ci_width=_tournament_ci_width, seed=_tournament_seed)
+        win_probability = result.p0_win_rate
+    return float(win_probability)
+
+
+if __name__ == '__main__':
+    """ Hold at n for n = 10..35, a random policy and the optimal policy """
+    from piggy.environment import Environment
+    from piggy.solution_cache import get_solution
+    from piggy.utils.create_policy import hold_at_n_policy, random_policy
+    target = 100
+    env = Environment(dice_sides=6, target_score=target)
+
+    _policies = {'hold at {}'.format(n): hold_at_n_policy(target_score=target, hold_at=n) for n in range(10, 36)}
+    np.random.seed(0)
+    _policies['random'] = random_policy(target_score=target)
+    _policies['optimal'] = get_solution(env.dice_sides, target)[1]
+
+    tournament = Tournament(environment=env, policies=_policies)
+    tournament.run()
+    tournament.print_results()
@@ -0,0 +1,124 @@
+import json
+import os
+
+import numpy as np
+
+from piggy.utils.layers import get_layer_rows
+from piggy.utils.policy_store import FILE_EXTENSION, get_die_key, get_roll, load_array, save_array
+
+
+class LayerCheckpoint:
+
+    def __init__(self, checkpoint_dir, environment, playing_piglet=False):
+        """
+        On-disk checkpoint of a layer by layer solve (see piggy.value_iteration.ValueIteration) - after each score_sum
+        layer is finished its values and policy are written into memory-mapped files (see piggy.utils.policy_store)
+        and progress.json records the layer, so an interrupted solve can resume from the last finished layer.
+
+        Parameters
+        ----------
+        checkpoint_dir: str
+        environment: piggy.environment.Environment
+        playing_piglet: bool, optional
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.environment = environment
+        self.playing_piglet = playing_piglet
+
+        self.vf_filepath = os.path.join(checkpoint_dir, 'value_func' + FILE_EXTENSION)
+        self.policy_filepath = os.path.join(checkpoint_dir, 'policy' + FILE_EXTENSION)
+        self.progress_filepath = os.path.join(checkpoint_dir, 'progress.json')
+        self._V = None
+        self._policy = None
+
+    def last_finished_layer(self):
+        """
+        Returns
+        -------
+        score_sum: int or None
+            the lowest score_sum layer that has been finished (layers are solved from the highest down) - None if no
+            layer has been finished
+        """
+        if not os.path.exists(self.progress_filepath):
+            return None
+        with open(self.progress_filepath, 'r', encoding='utf-8') as progress_file:
+            progress = json.load(progress_file)
+        game = (self.environment.dice_sides, self.environment.target_score, self.playing_piglet,
+                get_die_key(self.environment.die, self.environment.dice_sides))
+        if (progress['dice_sides'], progress['target_score'], progress['playing_piglet'], progress.get('die')) != game:
+            raise ValueError('Checkpoint in {} is for a different game'.format(self.checkpoint_dir))
+        return progress['last_finished_layer']
+
+    def reset(self):
+        """ Discard any finished layers """
+        if os.path.exists(self.progress_filepath):
+            os.remove(self.progress_filepath)
+        self._V = None
+        self._policy = None
+
+    def restore(self, V, policy):
+        """
+        Copy every finished layer into V and policy
+        Parameters
+        ----------
+        V: np.ndarray
+            (padded) value function indexed by (your_score, opponent_score, turn_score)
+        policy: np.ndarray
+
+        Returns
+        -------
+        last_finished_layer: int or None
+        """
+        last_finished_layer = self.last_finished_layer()
+        if last_finished_layer is not None:
+            self._open()
+            target_score = self.environment.target_score
+            your_score, opponent_score = np.indices((target_score, target_score))
+            finished = your_score + opponent_score >= last_finished_layer
+            V[:target_score, :target_score, :target_score][finished] = self._V[finished]
+            policy[:target_score, :target_score, :target_score][finished] = self._policy[finished]
+        return last_finished_layer
+
+    def write_layer(self, score_sum, V, policy):
+        """
+        Write a finished layer - the values are flushed before progress.json is updated so a layer is only ever
+        recorded as finished once it is on disk
+        Parameters
+        ----------
+        score_sum: int
+        V: np.ndarray
+        policy: np.ndarray
+        """
+        self._open()
+        target_score = self.environment.target_score
+        your_score, opponent_score = get_layer_rows(score_sum, target_score)
+        self._V[your_score, opponent_score] = V[your_score, opponent_score, :target_score]
+        self._policy[your_score, opponent_score] = get_roll(policy[your_score, opponent_score, :target_score])
+        self._V.base.flush()
+        self._policy.base.flush()
+
+        progress = {'dice_sides': self.environment.dice_sides,
+                    'target_score': target_score,
+                    'playing_piglet': self.playing_piglet,
+                    'last_finished_layer': score_sum}
+        die_key = get_die_key(self.environment.die, self.environment.dice_sides)
+        if die_key is not None:
+            progress['die'] = die_key
+        temp_filepath = self.progress_filepath + '.tmp'
+        with open(temp_filepath, 'w', encoding='utf-8') as progress_file:
+            json.dump(progress, progress_file)
+        os.replace(temp_filepath, self.progress_filepath)
+
+    def _open(self):
+        if self._V is not None:
+            return
+        if not os.path.exists(self.progress_filepath):
+            # New checkpoint - create the files (removing any left by a run that never finished a layer)
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            shape = (self.environment.target_score,)*3
+            save_array(self.vf_filepath, np.zeros(shape), 'value_func', self.environment.dice_sides,
+                       self.environment.target_score, self.playing_piglet, die=self.environment.die)
+            save_array(self.policy_filepath, np.zeros(shape), 'policy', self.environment.dice_sides,
+                       self.environment.target_score, self.playing_piglet, die=self.environment.die)
+        self._V, _ = load_array(self.vf_filepath, writable=True)
+        self._policy, _ = load_array(self.policy_filepath, writable=True)
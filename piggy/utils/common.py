@@ -1,5 +1,7 @@
 import itertools
 
+import numpy as np
+
 
 def won(state, target_score):
     return (state[0] + state[2]) >= target_score
@@ -47,3 +49,62 @@ def filter_non_playable_states(states, target_score):
     """
 
     return [state for state in states if not (won(state, target_score) or lost(state, target_score))]
+
+
+class PlayableStateIndex:
+
+    def __init__(self, target_score):
+        """
+        Compact index of all playable (your_score, opponents_score, turn_score) states grouped by score_sum.
+
+        States are held as three int16 coordinate arrays sorted by score_sum = your_score + opponents_score (and then by
+        your_score and turn_score) with layer_offsets marking where each layer starts - so the states of any layer can
+        be read straight off as array slices rather than by filtering every state.
+
+        Parameters
+        ----------
+        target_score: int
+        """
+        self.target_score = target_score
+
+        # All (your_score, opponents_score) pairs ordered by score_sum - each is then repeated once per turn_score
+        your_scores, opponents_scores = (x.ravel() for x in np.indices((target_score, target_score)))
+        order = np.argsort(your_scores + opponents_scores, kind='stable')
+        your_scores, opponents_scores = your_scores[order], opponents_scores[order]
+        turns_per_pair = target_score - your_scores  # turn_score ranges over 0 ... target_score - your_score - 1
+
+        self.your_score = np.repeat(your_scores, turns_per_pair).astype(np.int16)
+        self.opponents_score = np.repeat(opponents_scores, turns_per_pair).astype(np.int16)
+        pair_offsets = np.repeat(np.cumsum(turns_per_pair) - turns_per_pair, turns_per_pair)
+        self.turn_score = (np.arange(len(self.your_score)) - pair_offsets).astype(np.int16)
+
+        # layer_offsets[k]:layer_offsets[k+1] are the states with score_sum == k
+        states_per_layer = np.bincount(your_scores + opponents_scores, weights=turns_per_pair).astype(np.int64)
+        self.layer_offsets = np.concatenate([[0], np.cumsum(states_per_layer)])
+
+    def __len__(self):
+        return len(self.your_score)
+
+    def __iter__(self):
+        return zip(self.your_score.tolist(), self.opponents_score.tolist(), self.turn_score.tolist())
+
+    def layer(self, score_sum):
+        """
+        Returns the playable states in which your_score + opponents_score == score_sum as three coordinate arrays.
+
+        Parameters
+        ----------
+        score_sum: int
+
+        Returns
+        -------
+        your_score: np.ndarray
+        opponents_score: np.ndarray
+        turn_score: np.ndarray
+        """
+        start, stop = self.layer_offsets[score_sum], self.layer_offsets[score_sum + 1]
+        return self.your_score[start:stop], self.opponents_score[start:stop], self.turn_score[start:stop]
+
+    def layer_tuples(self, score_sum):
+        """ Same as layer() but as (your_score, opponents_score, turn_score) tuples """
+        return zip(*(coordinates.tolist() for coordinates in self.layer(score_sum)))
@@ -0,0 +1,160 @@
+import random
+
+import numpy as np
+
+
+""" The die as a transition kernel shared by every engine
+
+A die is a table face -> (probability, points) where points of 0 end the turn and lose the turn score (the 1 of a
+standard die) and any other points are added to the turn score. All that the game depends on is the probability of
+each distinct number of points - the kernel - so faces with the same points are merged. The simulators sample from
+the kernel with the alias method (a single uniform draw per roll, vectorizable) and the solvers and exact evaluators
+take expectations over it.
+"""
+
+
+class Die:
+
+    def __init__(self, faces):
+        """
+        Parameters
+        ----------
+        faces: dict
+            face -> (probability, points) - probabilities must sum to 1, points are non-negative integers and 0 ends
+            the turn
+        """
+        probabilities = np.array([probability for probability, _ in faces.values()], dtype=float)
+        points = np.array([points for _, points in faces.values()])
+        if len(faces) == 0 or np.any(probabilities < 0) or not np.isclose(probabilities.sum(), 1):
+            raise ValueError('Face probabilities must be non-negative and sum to 1')
+        if not np.issubdtype(points.dtype, np.integer) or np.any(points < 0):
+            raise ValueError('Face points must be non-negative integers')
+        if not np.any((points > 0) & (probabilities > 0)):
+            raise ValueError('At least one face must score points')
+        self.faces = dict(faces)
+
+        # Kernel - the probability of each distinct outcome (points scored, 0 first) of a roll
+        self.outcome_points, inverse = np.unique(np.append(points, 0), return_inverse=True)
+        self.outcome_probabilities = np.bincount(inverse[:-1], weights=probabilities,
+                                                 minlength=len(self.outcome_points)) / probabilities.sum()
+        self.pig_out_probability = self.outcome_probabilities[0]
+        self.scoring_points = self.outcome_points[1:]
+        self.scoring_probabilities = self.outcome_probabilities[1:]
+        self.max_points = max(int(self.outcome_points[-1]), 1)  # how far a roll can take the turn score
+
+        # With equally likely outcomes (any fair die) expectations are a sum divided by the number of outcomes - the
+        # same arithmetic as the original fair die engines, so their results are unchanged to the last bit
+        self.num_outcomes = len(self.outcome_points)
+        self.is_uniform = bool(np.all(self.outcome_probabilities == self.outcome_probabilities[0]))
+        self._is_fair = self.is_uniform and self.outcome_points.tolist() == [0] + list(range(2, self.num_outcomes + 1))
+        self._outcome_points_int32 = self.outcome_points.astype(np.int32)
+
+        # Alias tables - outcome i is kept with probability _keep[i] and otherwise replaced by _alias[i]
+        self._keep, self._alias = _build_alias_table(self.outcome_probabilities)
+        self._outcome_points_list = self.outcome_points.tolist()
+        self._keep_list = self._keep.tolist()
+        self._alias_points_list = self.outcome_points[self._alias].tolist()
+
+    @classmethod
+    def fair(cls, dice_sides):
+        """ Standard die - face 1 ends the turn and faces 2..dice_sides score their number """
+        return cls({face: (1 / dice_sides, 0 if face == 1 else face) for face in range(1, dice_sides + 1)})
+
+    @classmethod
+    def piglet(cls):
+        """ Coin of piglet - tails ends the turn and heads scores 1 """
+        return cls({'tails': (0.5, 0), 'heads': (0.5, 1)})
+
+    def key(self):
+        """
+        Returns
+        -------
+        key: list
+            [points, probability] of each outcome - the same for any two dice that play the same (JSON serialisable)
+        """
+        return [[int(points), float(probability)]
+                for points, probability in zip(self.outcome_points, self.outcome_probabilities)]
+
+    def sample(self, size, rng):
+        """
+        Parameters
+        ----------
+        size: int or tuple
+        rng: np.random.Generator
+
+        Returns
+        -------
+        points: np.ndarray
+            int32 points scored by each roll - 0 ends the turn
+        """
+        if self._is_fair:  # roll the faces and zero the 1s - cheaper than looking up the points of each outcome
+            points = rng.integers(1, self.num_outcomes + 1, size=size, dtype=np.int32)
+            points *= points != 1
+            return points
+        if self.is_uniform:
+            return self._outcome_points_int32[rng.integers(0, self.num_outcomes, size=size, dtype=np.int32)]
+        u = rng.random(size) * self.num_outcomes
+        outcome = u.astype(np.int32)
+        outcome = np.where(u - outcome < self._keep[outcome], outcome, self._alias[outcome])
+        return self._outcome_points_int32[outcome]
+
+    def sample_one(self, random_state=None):
+        """
+        Same as sample() for a single roll using the random module - avoids numpy call overhead
+        Parameters
+        ----------
+        random_state: random.Random, optional
+            defaults to the random module's global generator
+
+        Returns
+        -------
+        points: int
+        """
+        u = (random if random_state is None else random_state).random() * self.num_outcomes
+        outcome = int(u)
+        if u - outcome < self._keep_list[outcome]:
+            return self._outcome_points_list[outcome]
+        return self._alias_points_list[outcome]
+
+    def roll_value(self, pig_out_value, scoring_values):
+        """
+        Expected value of rolling
+        Parameters
+        ----------
+        pig_out_value: float or np.ndarray
+            value if the roll ends the turn
+        scoring_values: np.ndarray
+            [..., len(scoring_points)] value after scoring each of scoring_points
+
+        Returns
+        -------
+        value: float or np.ndarray
+        """
+        if self.is_uniform:
+            return (pig_out_value + scoring_values.sum(axis=-1)) / self.num_outcomes
+        return self.pig_out_probability * pig_out_value + scoring_values @ self.scoring_probabilities
+
+
+def _build_alias_table(probabilities):
+    """
+    Vose's alias method - O(1) sampling from a discrete distribution
+
+    Returns
+    -------
+    keep: np.ndarray
+        probability of keeping each outcome
+    alias: np.ndarray
+        outcome used otherwise
+    """
+    n = len(probabilities)
+    scaled = list(np.asarray(probabilities, dtype=float) * n)
+    keep = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        keep[i], alias[i] = scaled[i], j
+        scaled[j] -= 1 - scaled[i]
+        (small if scaled[j] < 1 else large).append(j)
+    return keep, alias
@@ -0,0 +1,177 @@
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+
+
+""" Opt-in instrumentation for solvers and learners
+
+Solvers and learners take an optional Instrumentation - when it is None (the default) nothing is timed or counted, so
+leaving instrumentation off costs no more than an `is None` check outside the innermost loops. When given it collects:
+
+- timers - total wall time spent in each named phase e.g. 'opponent turn' or 'evaluation'
+- counters - e.g. env steps, Q updates or opponent turns
+- records - structured dicts e.g. one per solved layer with its sweeps, delta history and wall time
+
+which can be exported as JSON lines or scalars to a piggy.utils.metrics sink. profile() wraps any block of code with
+cProfile and/or tracemalloc.
+"""
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.timers = defaultdict(float)  # name -> seconds
+        self.counters = defaultdict(int)  # name -> count
+        self.records = []  # dicts - each with a 'kind'
+
+    def timer(self, name):
+        """
+        Context manager that adds the wall time of the block to timers[name]
+        Parameters
+        ----------
+        name: str
+        """
+        return _Timer(self.timers, name)
+
+    def add_time(self, name, seconds):
+        """
+        Add time measured elsewhere to timers[name] - for hot loops that read the clock themselves
+        Parameters
+        ----------
+        name: str
+        seconds: float
+        """
+        self.timers[name] += seconds
+
+    def count(self, name, n=1):
+        """
+        Parameters
+        ----------
+        name: str
+        n: int, optional
+        """
+        self.counters[name] += int(n)
+
+    def record(self, kind, **fields):
+        """
+        Append a structured record
+        Parameters
+        ----------
+        kind: str
+            e.g. 'layer'
+        fields:
+            JSON serialisable values
+        """
+        self.records.append({'kind': kind, **fields})
+
+    def summary(self):
+        """
+        Returns
+        -------
+        summary: dict
+            timers, counters and - for each counter - its rate per second of the total time of every timer
+        """
+        total_time = sum(self.timers.values())
+        rates = {name: count / total_time for name, count in self.counters.items()} if total_time > 0 else {}
+        return {'timers': dict(self.timers), 'counters': dict(self.counters), 'rates_per_second': rates}
+
+    def write_jsonl(self, file_path):
+        """
+        Write every record followed by the summary (as a record of kind 'summary') - one JSON object per line
+        Parameters
+        ----------
+        file_path: str
+        """
+        with open(file_path, 'w', encoding='utf-8') as file:
+            for record in self.records + [{'kind': 'summary', **self.summary()}]:
+                file.write(json.dumps(record, ensure_ascii=False, default=float) + '\n')
+
+    def write_scalars(self, metrics_sink, step):
+        """
+        Log every timer and counter to a metrics sink
+        Parameters
+        ----------
+        metrics_sink: piggy.utils.metrics.MetricsSink
+        step: int
+        """
+        for name, seconds in self.timers.items():
+            metrics_sink.scalar('time/{}'.format(name), seconds, step=step)
+        for name, count in self.counters.items():
+            metrics_sink.scalar('count/{}'.format(name), count, step=step)
+
+
+class _Timer:
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timers[self.name] += time.perf_counter() - self.start_time
+
+
+def maybe_timer(instrumentation, name):
+    """
+    instrumentation.timer(name) - or a no-op context manager if instrumentation is None
+    Parameters
+    ----------
+    instrumentation: Instrumentation or None
+    name: str
+    """
+    return contextlib.nullcontext() if instrumentation is None else instrumentation.timer(name)
+
+
+@contextlib.contextmanager
+def profile(instrumentation=None, profile_path=None, trace_memory=False, print_top=20):
+    """
+    Profile a block of code with cProfile and/or tracemalloc e.g.
+
+        with profile(instrumentation, profile_path='vi.prof', trace_memory=True):
+            value_iteration.run()
+
+    Parameters
+    ----------
+    instrumentation: Instrumentation, optional
+        if given a record of kind 'profile' is added with the wall time and (if trace_memory) peak traced memory
+    profile_path: str, optional
+        if given cProfile is run and its stats are written here (e.g. for snakeviz) - and the print_top functions by
+        cumulative time are printed
+    trace_memory: bool, optional
+        if True tracemalloc traces memory allocated in the block
+    print_top: int, optional
+    """
+    profiler = cProfile.Profile() if profile_path is not None else None
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall_time = time.perf_counter() - start_time
+
+        record = {'wall_time': wall_time}
+        if trace_memory:
+            _, record['peak_traced_memory_bytes'] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+            record['profile_path'] = profile_path
+            stats_text = io.StringIO()
+            pstats.Stats(profiler, stream=stats_text).sort_stats('cumulative').print_stats(print_top)
+            print(stats_text.getvalue())
+        if instrumentation is not None:
+            instrumentation.record('profile', **record)
@@ -0,0 +1,260 @@
+import numpy as np
+
+MAX_NEWTON_ITERATIONS = 50  # Newton solves a layer in a handful of iterations - beyond this it falls back to sweeps
+SWEEP_TOLERANCE = 1e-15
+
+""" Helpers for solving pig one score_sum layer at a time
+
+Within the layer where your_score + opponents_score == k every state (a, b, t) depends only on states in higher layers
+(through holding with t > 0), states (a, b, t + roll) in the same row (through rolling) and the start-of-turn state of
+the other player (b, a, 0) (through rolling a 1). Given the value y of that start-of-turn state, a single backward pass
+over turn_score therefore expresses every value in row a as an affine function α + β·y of it. The only remaining
+unknowns are then the coupled pairs x_a = V(a, b, 0) and x_b = V(b, a, 0) which can be solved for directly.
+
+Layers are laid out as 2D blocks - one row per your_score a in the layer (in ascending order, so the row of the other
+player's start-of-turn state is the reversed row order) and one column per turn_score t. Columns run past target_score
+by the largest scoring roll so that rolling never indexes out of bounds - cells where a + t >= target_score are won.
+
+Rolls are expectations over the die's transition kernel (see piggy.utils.die) - for piglet use Die.piglet() in place of
+the environment's die.
+"""
+
+
+def create_padded_value_function(target_score, die):
+    """
+    Create a randomly initialised value function array with terminal values filled in - 1 where you have won and 0
+    where you have lost. The turn_score axis is padded so that every roll from a playable state lands inside the array.
+
+    Parameters
+    ----------
+    target_score: int
+    die: piggy.utils.die.Die
+
+    Returns
+    -------
+    V: np.ndarray
+        [target_score + 1, target_score + 1, target_score + die.max_points] array
+    """
+    V = np.random.random(size=(target_score + 1, target_score + 1, target_score + die.max_points))
+    your_score, opponent_score, turn_score = np.indices(V.shape)
+    V[opponent_score >= target_score] = 0
+    V[your_score + turn_score >= target_score] = 1
+    return V
+
+
+def get_layer_rows(score_sum, target_score):
+    """
+    Returns the your_score / opponents_score of each row in the 2D block layout of a layer
+
+    Parameters
+    ----------
+    score_sum: int
+    target_score: int
+
+    Returns
+    -------
+    your_score: np.ndarray
+    opponents_score: np.ndarray
+    """
+    your_score = np.arange(max(0, score_sum - (target_score - 1)), min(score_sum, target_score - 1) + 1)
+    return your_score, score_sum - your_score
+
+
+def get_hold_scores(your_score, target_score):
+    """
+    Your score after holding at each turn score - clipped to target_score as every score from there on is won
+
+    Parameters
+    ----------
+    your_score: np.ndarray
+        [n] your_score of each row
+    target_score: int
+
+    Returns
+    -------
+    hold_your_score: np.ndarray
+        [n, target_score]
+    """
+    return np.minimum(your_score[:, None] + np.arange(target_score)[None, :], target_score)
+
+
+def backward_pass(your_score, target_score, die, hold_value, pig_out_alpha, pig_out_beta, roll=None,
+                  coupling_value=None):
+    """
+    Express every value in a layer as α + β·y where y is the value coupled to each row through rolling a 1.
+
+    Rolling at turn_score 0 is enforced (as in piggy.agent.Agent) so α and β at t=0 always come from rolling.
+
+    Parameters
+    ----------
+    your_score: np.ndarray
+        [n] your_score of each row - must be in ascending order
+    target_score: int
+    die: piggy.utils.die.Die
+    hold_value: np.ndarray
+        [n, target_score] value of holding at each turn_score (known as it only depends on higher layers) - column 0
+        is not used as holding with a turn score of 0 is the same as rolling a 1
+    pig_out_alpha: np.ndarray
+        [n] value of rolling a 1 is pig_out_alpha + pig_out_beta·y
+    pig_out_beta: np.ndarray
+        [n]
+    roll: np.ndarray, optional
+        [n, target_score] bool - fixed policy to evaluate. If None the greedy action given coupling_value is taken.
+    coupling_value: np.ndarray, optional
+        [n] current estimate of y - required if roll is None
+
+    Returns
+    -------
+    alpha: np.ndarray
+        [n, target_score + die.max_points]
+    beta: np.ndarray
+        [n, target_score + die.max_points]
+    roll: np.ndarray
+        [n, target_score] bool - the policy that was evaluated (greedy ties go to hold)
+    """
+    # Everything is laid out turn_score-major with α and β stacked (so both are updated by the same operation) and each
+    # step of the pass reads and writes contiguous blocks. As your_score is ascending the cells that are still playable
+    # at turn_score t are a prefix of the rows.
+    n = len(your_score)
+    alpha_beta = np.zeros((target_score + die.max_points, 2, n))
+    alpha_beta[:, 0] = 1  # every cell is initialised as won...
+    hold_alpha_beta = np.zeros((target_score, 2, n))
+    hold_alpha_beta[:, 0] = hold_value.T
+    pig_out_alpha_beta = np.stack([pig_out_alpha, pig_out_beta])
+    greedy = roll is None
+    roll = np.zeros((target_score, n), dtype=bool) if greedy else roll.T
+    num_playable = np.searchsorted(your_score, target_score - np.arange(target_score))
+
+    # A roll window that is a contiguous range of turn scores can be summed as a slice rather than gathered - and
+    # equally likely outcomes (any fair die) summed and divided by their number rather than weighted
+    scoring_points = die.scoring_points
+    contiguous = die.is_uniform and np.array_equal(scoring_points, np.arange(scoring_points[0], scoring_points[-1] + 1))
+    lowest_roll, highest_roll = scoring_points[0], scoring_points[-1]
+
+    for t in range(target_score - 1, -1, -1):
+        m = num_playable[t]  # ...and only playable cells are overwritten
+        if m == 0:
+            continue
+
+        if contiguous:
+            roll_alpha_beta = alpha_beta[t + lowest_roll:t + highest_roll + 1, :, :m].sum(axis=0)
+            roll_alpha_beta += pig_out_alpha_beta[:, :m]
+            roll_alpha_beta /= die.num_outcomes
+        elif die.is_uniform:
+            roll_alpha_beta = alpha_beta[t + scoring_points, :, :m].sum(axis=0)
+            roll_alpha_beta += pig_out_alpha_beta[:, :m]
+            roll_alpha_beta /= die.num_outcomes
+        else:
+            roll_alpha_beta = np.tensordot(die.scoring_probabilities, alpha_beta[t + scoring_points, :, :m], axes=1)
+            roll_alpha_beta += die.pig_out_probability * pig_out_alpha_beta[:, :m]
+
+        if t == 0:
+            if greedy:
+                roll[t] = (roll_alpha_beta[0] + roll_alpha_beta[1] * coupling_value) > \
+                          (pig_out_alpha + pig_out_beta * coupling_value)
+            alpha_beta[t] = roll_alpha_beta
+            continue
+
+        if greedy:
+            roll[t, :m] = (roll_alpha_beta[0] + roll_alpha_beta[1] * coupling_value[:m]) > hold_alpha_beta[t, 0, :m]
+        alpha_beta[t, :, :m] = np.where(roll[t, :m], roll_alpha_beta, hold_alpha_beta[t, :, :m])
+
+    return alpha_beta[:, 0].T, alpha_beta[:, 1].T, roll.T
+
+
+def solve_layer_newton(your_score, target_score, die, hold_value, pig_out_alpha, pig_out_beta, coupling_value,
+                       coupled_pairs=True, max_iterations=MAX_NEWTON_ITERATIONS):
+    """
+    Solve a layer for its greedy (optimal) values and policy.
+
+    The value of every row is piecewise linear in the value y it is coupled to. Newton's method solves the
+    linearization at the current y exactly, re-selects the greedy actions and stops as soon as they no longer change -
+    at which point the layer is at its fixed point to machine precision. Improving coupled rows together isn't
+    guaranteed to converge (e.g. for unusual dice) so after max_iterations it falls back to value iteration sweeps on
+    y - a contraction - until y stops changing.
+
+    Parameters
+    ----------
+    your_score: np.ndarray
+        [n] your_score of each row - must be in ascending order
+    target_score: int
+    die: piggy.utils.die.Die
+    hold_value: np.ndarray
+        [n, target_score] see backward_pass
+    pig_out_alpha: np.ndarray
+        [n] see backward_pass
+    pig_out_beta: np.ndarray
+        [n]
+    coupling_value: np.ndarray
+        [n] initial guess for y
+    coupled_pairs: bool, optional
+        True if rows are coupled in pairs as in solve_coupled_pairs (y of row i is the start-of-turn value of row
+        n - 1 - i), False if each row is coupled to its own start-of-turn value (y = value of the row at turn_score 0)
+    max_iterations: int, optional
+
+    Returns
+    -------
+    alpha: np.ndarray
+        [n, target_score + die.max_points]
+    beta: np.ndarray
+        [n, target_score + die.max_points]
+    roll: np.ndarray
+        [n, target_score] bool - greedy policy
+    coupling_value: np.ndarray
+        [n] y at the fixed point - values are alpha + beta·y
+    deltas: list
+        largest change in y after each iteration
+    """
+    y = coupling_value
+    deltas = []
+    roll = None
+    for _ in range(max_iterations):
+        old_roll = roll
+        alpha, beta, roll = backward_pass(your_score, target_score, die, hold_value, pig_out_alpha, pig_out_beta,
+                                          coupling_value=y)
+        if coupled_pairs:
+            old_y, y = y, solve_coupled_pairs(alpha[:, 0], beta[:, 0])[::-1]
+        else:
+            old_y, y = y, alpha[:, 0] / (1 - beta[:, 0])
+        deltas.append(float(np.abs(y - old_y).max()))
+        if old_roll is not None and np.array_equal(roll, old_roll):
+            return alpha, beta, roll, y, deltas
+
+    # Value iteration - every sweep applies the greedy backup to y once
+    delta = np.inf
+    while delta > SWEEP_TOLERANCE:
+        alpha, beta, roll = backward_pass(your_score, target_score, die, hold_value, pig_out_alpha, pig_out_beta,
+                                          coupling_value=y)
+        x = alpha[:, 0] + beta[:, 0] * y
+        old_y, y = y, x[::-1] if coupled_pairs else x
+        delta = float(np.abs(y - old_y).max())
+        deltas.append(delta)
+    alpha, beta, roll = backward_pass(your_score, target_score, die, hold_value, pig_out_alpha, pig_out_beta,
+                                      coupling_value=y)
+    return alpha, beta, roll, y, deltas
+
+
+def solve_coupled_pairs(alpha, beta, partner_alpha=None, partner_beta=None):
+    """
+    Solve x_i = α_i + β_i·x'_j, x'_j = α'_j + β'_j·x_i for every pair of rows i, j = n - 1 - i (i.e. V(a, b, 0) and
+    V(b, a, 0)). The partner values x' are the same values x unless the other player follows a different policy.
+
+    Parameters
+    ----------
+    alpha: np.ndarray
+        [n] α at turn_score 0
+    beta: np.ndarray
+        [n] β at turn_score 0
+    partner_alpha: np.ndarray, optional
+        [n] α' at turn_score 0 - defaults to alpha
+    partner_beta: np.ndarray, optional
+        [n] β' at turn_score 0 - defaults to beta
+
+    Returns
+    -------
+    x: np.ndarray
+        [n]
+    """
+    partner_alpha = alpha if partner_alpha is None else partner_alpha
+    partner_beta = beta if partner_beta is None else partner_beta
+    return (alpha + beta * partner_alpha[::-1]) / (1 - beta * partner_beta[::-1])
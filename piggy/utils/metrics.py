@@ -0,0 +1,170 @@
+import csv
+import json
+import os
+
+
+""" Sinks for the scalar metrics logged during training e.g. win rate against a fixed opponent
+
+Every sink has the same interface - scalar(name, value, step) to record a value plus flush() and close() - and can be
+used as a context manager (which closes it on exit). File sinks buffer records in memory and write them in batches.
+"""
+
+
+class MetricsSink:
+
+    def scalar(self, name, value, step):
+        """
+        Record a scalar
+        Parameters
+        ----------
+        name: str
+        value: float
+        step: int
+            e.g. episode
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """ Write any buffered records """
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class InMemorySink(MetricsSink):
+
+    def __init__(self):
+        """ Keeps every record in memory - e.g. for notebooks and tests """
+        self.records = []  # dicts of step, name and value
+
+    def scalar(self, name, value, step):
+        self.records.append({'step': int(step), 'name': name, 'value': float(value)})
+
+    def values(self, name):
+        """
+        Parameters
+        ----------
+        name: str
+
+        Returns
+        -------
+        steps: list
+        values: list
+        """
+        records = [record for record in self.records if record['name'] == name]
+        return [record['step'] for record in records], [record['value'] for record in records]
+
+
+class _BufferedFileSink(MetricsSink):
+
+    def __init__(self, file_path, buffer_size):
+        self.file_path = file_path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+
+    def scalar(self, name, value, step):
+        self._buffer.append({'step': int(step), 'name': name, 'value': float(value)})
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with open(self.file_path, 'a', encoding='utf-8', newline='') as file:
+                self._write(file, self._buffer)
+            self._buffer = []
+
+    def _write(self, file, records):
+        raise NotImplementedError
+
+
+class JsonlSink(_BufferedFileSink):
+
+    def __init__(self, file_path, buffer_size=100):
+        """
+        Appends one JSON object per record - {"step": ..., "name": ..., "value": ...}
+        Parameters
+        ----------
+        file_path: str
+        buffer_size: int, optional
+            number of records to buffer before writing
+        """
+        super().__init__(file_path, buffer_size)
+
+    def _write(self, file, records):
+        file.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+
+class CsvSink(_BufferedFileSink):
+
+    def __init__(self, file_path, buffer_size=100):
+        """
+        Appends one step,name,value row per record - with a header if the file is new
+        Parameters
+        ----------
+        file_path: str
+        buffer_size: int, optional
+            number of records to buffer before writing
+        """
+        super().__init__(file_path, buffer_size)
+
+    def _write(self, file, records):
+        writer = csv.DictWriter(file, fieldnames=['step', 'name', 'value'])
+        if file.tell() == 0:
+            writer.writeheader()
+        writer.writerows(records)
+
+
+class TensorBoardSink(MetricsSink):
+
+    def __init__(self, output_dir):
+        """
+        Writes tf.summary scalars - TensorFlow is only imported when this sink is created
+        Parameters
+        ----------
+        output_dir: str
+        """
+        import tensorflow as tf
+        self._tf = tf
+        self._writer = tf.summary.create_file_writer(output_dir)
+
+    def scalar(self, name, value, step):
+        with self._writer.as_default():
+            self._tf.summary.scalar(name, value, step=step)
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+
+def create_metrics_sink(kind, output_dir):
+    """
+    Parameters
+    ----------
+    kind: str
+        'tensorboard', 'jsonl', 'csv' or 'memory'
+    output_dir: str
+        directory for file based sinks - files are named metrics.jsonl / metrics.csv
+
+    Returns
+    -------
+    sink: MetricsSink
+    """
+    if kind == 'tensorboard':
+        return TensorBoardSink(output_dir)
+    elif kind == 'jsonl':
+        return JsonlSink(os.path.join(output_dir, 'metrics.jsonl'))
+    elif kind == 'csv':
+        return CsvSink(os.path.join(output_dir, 'metrics.csv'))
+    elif kind == 'memory':
+        return InMemorySink()
+    raise ValueError('Unknown metrics sink: {}'.format(kind))
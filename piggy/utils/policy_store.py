@@ -0,0 +1,252 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from piggy.utils.die import Die
+
+""" Compact on-disk store for policies and value functions
+
+Each file holds a single array preceded by a small header:
+
+    b'PIGGY' + format version (uint8) + header length (uint32 little-endian) + JSON header + padding + array data
+
+The JSON header records what the array is (kind - 'policy' or 'value_func'), the game it belongs to (dice_sides,
+target_score, playing_piglet - and die, the kernel of piggy.utils.die.Die, for any die other than a fair one) and how to
+read it (dtype, shape, offset of the data). Policies are stored as uint8 and
+value functions as float32 or float64. The data is aligned and C-contiguous so files are opened with np.memmap - any
+number of processes reading the same file share one copy of it in the page cache and lookups cost the same as on an
+in-memory array.
+"""
+
+MAGIC = b'PIGGY'
+FORMAT_VERSION = 1
+FILE_EXTENSION = '.piggy'
+_ALIGNMENT = 64
+_PREFIX = struct.Struct('<5sBI')  # magic, format version, header length
+
+
+def save_array(file_path, array, kind, dice_sides, target_score, playing_piglet=False, dtype=None, die=None):
+    """
+    Parameters
+    ----------
+    file_path: str
+    array: np.ndarray
+    kind: str
+        'policy' or 'value_func'
+    dice_sides: int
+    target_score: int
+    playing_piglet: bool, optional
+    dtype: np.dtype, optional
+        defaults to uint8 for policies and float64 for value functions
+    die: piggy.utils.die.Die, optional
+        the die played with - recorded in the header unless it is a fair dice_sides sided die
+
+    Returns
+    -------
+    file_path: str
+    """
+    if dtype is None:
+        dtype = np.uint8 if kind == 'policy' else np.float64
+    array = np.ascontiguousarray(array, dtype=dtype)
+    metadata = create_array(file_path, array.shape, kind, dice_sides, target_score, playing_piglet, dtype, die)
+    with open(file_path, 'r+b') as file:
+        file.seek(metadata['offset'])
+        file.write(array.tobytes())
+    return file_path
+
+
+def create_array(file_path, shape, kind, dice_sides, target_score, playing_piglet=False, dtype=None, die=None):
+    """
+    Create a zero filled file without holding the array in memory (the data is sparse on most file systems until
+    written) - e.g. to be filled in piece by piece by piggy.streaming_value_iteration.StreamingValueIteration
+    Parameters
+    ----------
+    file_path: str
+    shape: tuple
+    kind: str
+        'policy' or 'value_func'
+    dice_sides: int
+    target_score: int
+    playing_piglet: bool, optional
+    dtype: np.dtype, optional
+        defaults to uint8 for policies and float64 for value functions
+    die: piggy.utils.die.Die, optional
+        see save_array
+
+    Returns
+    -------
+    metadata: dict
+        see read_metadata
+    """
+    if kind not in ('policy', 'value_func'):
+        raise ValueError('Unknown kind: {}'.format(kind))
+    if dtype is None:
+        dtype = np.uint8 if kind == 'policy' else np.float64
+    dtype = np.dtype(dtype)
+
+    header = {'kind': kind,
+              'dice_sides': int(dice_sides),
+              'target_score': int(target_score),
+              'playing_piglet': bool(playing_piglet),
+              'dtype': dtype.str,
+              'shape': [int(n) for n in shape]}
+    die_key = get_die_key(die, dice_sides)
+    if die_key is not None:
+        header['die'] = die_key
+
+    # The data offset depends on the header length which depends on the offset - pad the offset to the alignment and
+    # reserve enough digits for it up front
+    header['offset'] = 10 ** 9
+    header_length = len(json.dumps(header).encode('utf-8'))
+    header['offset'] = -(-(_PREFIX.size + header_length) // _ALIGNMENT) * _ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header['offset'] - _PREFIX.size)
+
+    with open(file_path, 'wb') as file:
+        file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        file.truncate(header['offset'] + int(np.prod(shape)) * dtype.itemsize)
+    return header
+
+
+def read_metadata(file_path):
+    """
+    Parameters
+    ----------
+    file_path: str
+
+    Returns
+    -------
+    metadata: dict
+        kind, dice_sides, target_score, playing_piglet, dtype, shape and offset - plus die if it isn't a fair one
+    """
+    with open(file_path, 'rb') as file:
+        prefix = file.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError('{} is not a piggy store file'.format(file_path))
+        magic, version, header_length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError('{} is not a piggy store file'.format(file_path))
+        if version != FORMAT_VERSION:
+            raise ValueError('{} has unsupported format version {}'.format(file_path, version))
+        return json.loads(file.read(header_length).decode('utf-8'))
+
+
+def load_array(file_path, mmap=True, environment=None, playing_piglet=None, writable=False):
+    """
+    Parameters
+    ----------
+    file_path: str
+    mmap: bool, optional
+        if True (default) the array is a read-only memory map of the file, otherwise it is read into memory
+    environment: piggy.environment.Environment, optional
+        if given the file must be for the same dice_sides, target_score and die
+    playing_piglet: bool, optional
+        if given the file must be for the same rules
+    writable: bool, optional
+        if True (and mmap) writes to the array go straight to the file
+
+    Returns
+    -------
+    array: np.ndarray
+    metadata: dict
+    """
+    metadata = read_metadata(file_path)
+    if environment is not None and (metadata['dice_sides'], metadata['target_score']) != \
+            (environment.dice_sides, environment.target_score):
+        raise ValueError('{} is for a {} sided die with target {} not a {} sided die with target {}'.format(
+            file_path, metadata['dice_sides'], metadata['target_score'],
+            environment.dice_sides, environment.target_score))
+    if environment is not None and metadata.get('die') != get_die_key(environment.die, environment.dice_sides):
+        raise ValueError('{} is for a die with kernel {} not {}'.format(file_path, metadata.get('die', 'fair'),
+                                                                       environment.die.key()))
+    if playing_piglet is not None and metadata['playing_piglet'] != playing_piglet:
+        raise ValueError('{} is for playing_piglet={}'.format(file_path, metadata['playing_piglet']))
+
+    shape = tuple(metadata['shape'])
+    if mmap:
+        # Viewed as a plain ndarray (still backed by the mapping) as np.memmap adds overhead to every scalar lookup
+        array = np.memmap(file_path, dtype=np.dtype(metadata['dtype']), mode='r+' if writable else 'r',
+                          offset=metadata['offset'], shape=shape).view(np.ndarray)
+    else:
+        with open(file_path, 'rb') as file:
+            file.seek(metadata['offset'])
+            array = np.fromfile(file, dtype=np.dtype(metadata['dtype']), count=int(np.prod(shape))).reshape(shape)
+    return array, metadata
+
+
+def save_solution(output_dir, name, V, policy, environment, playing_piglet=False, value_dtype=np.float64):
+    """
+    Save a value function and policy - the files are named {value_func|policy}__{name}{FILE_EXTENSION}
+    Parameters
+    ----------
+    output_dir: str
+    name: str
+    V: np.ndarray
+        [target_score + 1, target_score + 1, target_score + 1] - or padded along turn_score, which is stripped
+    policy: np.ndarray
+        indexed by (your_score, opponent_score, turn_score) - only the playable [target_score]^3 block is kept
+    environment: piggy.environment.Environment
+    playing_piglet: bool, optional
+    value_dtype: np.dtype, optional
+        float64 (default) or float32
+
+    Returns
+    -------
+    vf_filepath: str
+    policy_filepath: str
+    """
+    target_score = environment.target_score
+    filepath_template = os.path.join(output_dir, '{}__' + name + FILE_EXTENSION)
+    vf_filepath = save_array(filepath_template.format('value_func'), V[:, :, :target_score + 1], 'value_func',
+                             environment.dice_sides, target_score, playing_piglet, dtype=value_dtype,
+                             die=environment.die)
+    # Cells where your_score + turn_score >= target_score are never played (the game is already won) - they are
+    # stored as 0 so that the same solution always gives the same file whatever those cells were initialised to
+    your_score, _, turn_score = np.indices((target_score,)*3)
+    roll = get_roll(policy, target_score) & (your_score + turn_score < target_score)
+    policy_filepath = save_array(filepath_template.format('policy'), roll, 'policy', environment.dice_sides,
+                                 target_score, playing_piglet, die=environment.die)
+    return vf_filepath, policy_filepath
+
+
+def get_roll(policy, target_score=None):
+    """
+    Where a policy rolls - only an action of exactly 1 is a roll, as in piggy.environment.Environment.take_action.
+    Everything that reads a policy (the agents, evaluators, solvers, checkpoints and stored files) goes through this
+    so that a policy holding values other than 0 and 1 plays the same wherever it is used
+    Parameters
+    ----------
+    policy: array_like
+    target_score: int, optional
+        if given only the [target_score]^3 cells in which the game is still being played are returned
+
+    Returns
+    -------
+    roll: np.ndarray
+        bool
+    """
+    policy = np.asarray(policy)
+    if target_score is not None:
+        policy = policy[:target_score, :target_score, :target_score]
+    return policy == 1
+
+
+def get_die_key(die, dice_sides):
+    """
+    Kernel of a die to record with anything solved or learned for it - None for a fair dice_sides sided die, so what
+    was recorded for fair dice before any other die could be played is unchanged
+    Parameters
+    ----------
+    die: piggy.utils.die.Die or None
+    dice_sides: int
+
+    Returns
+    -------
+    key: list or None
+        see piggy.utils.die.Die.key
+    """
+    if die is None or die.key() == Die.fair(dice_sides).key():
+        return None
+    return die.key()
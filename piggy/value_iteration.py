@@ -1,9 +1,15 @@
 import os
+import time
 
 import numpy as np
 from tqdm import tqdm
 
-from piggy.utils.common import get_all_playable_states, won, lost
+from piggy.utils.checkpoint import LayerCheckpoint
+from piggy.utils.common import PlayableStateIndex, won, lost
+from piggy.utils.die import Die
+from piggy.utils.instrumentation import maybe_timer
+from piggy.utils.layers import create_padded_value_function, get_hold_scores, get_layer_rows, solve_layer_newton
+from piggy.utils.policy_store import save_solution
 from definition import ROOT_DIR
 
 
@@ -31,10 +37,12 @@ class ValueIteration:
         ----------
         environment: piggy.environment.Environment
         eps: float
-            minimum max difference between V(s) between successive iterations across all states s
+            minimum max difference between V(s) between successive iterations across all states s - not used when
+            running with engine='exact'
         playing_piglet: bool, optional
-            affects line 67 - for pig the scoring rolls are 2-num_dice_sides but for piglet rolling a head scores
-            a 1 not a 2 (as it would if we considered a coin to be a two sided die with 1 and 2 on it)
+            if True the environment's die is replaced by Die.piglet() - for pig the scoring rolls are 2-num_dice_sides
+            but for piglet rolling a head scores a 1 not a 2 (as it would if we considered a coin to be a two sided die
+            with 1 and 2 on it)
         """
         if environment.dice_sides == 2 and not playing_piglet:
             print('\nWarning! - Set playing_piglet=True if you are playing with piglet rules\n')
@@ -46,11 +54,26 @@ class ValueIteration:
         self.eps = eps
         self.playing_piglet = playing_piglet
 
-        self.states = get_all_playable_states(target_score=environment.target_score)
-        self._V = np.random.random(size=(environment.target_score+1,)*3)
+        self.states = PlayableStateIndex(target_score=environment.target_score)
+
+        # V is stored padded along the turn_score axis with terminal values already filled in so the vectorized engine
+        # can gather neighbouring values without any won/lost checks.
+        self.die = Die.piglet() if playing_piglet else environment.die
+        self._V = create_padded_value_function(environment.target_score, self.die)
 
         self.policy = np.random.random(size=(environment.target_score+1,)*3)
 
+        self._warm_started = False
+        self._checkpoint = None
+        self._first_layer = 2 * (environment.target_score - 1)
+
+        # Sweeps (Newton steps for the exact engine), delta after each sweep and wall time for each score_sum layer -
+        # filled in by run()
+        self.layer_stats = []
+        self._layer_deltas = []
+        self._progress_callback = None
+        self._instrumentation = None
+
     def V(self, state):
         """
         Getter method for value function - Returns 1 if already won, 0 if lost and V(s) otherwise.
@@ -69,37 +92,184 @@ class ValueIteration:
         else:
             return self._V[state[0], state[1], state[2]]
 
-    def run(self):
+    def run(self, engine='numpy', checkpoint_dir=None, resume=False, progress_callback=None, instrumentation=None):
+        """
+        Run value iteration until convergence
+        Parameters
+        ----------
+        engine: str, optional
+            'numpy' performs the backup of each score_sum layer as whole-array operations over that layer's states,
+            'python' is the original state-by-state implementation (orders of magnitude slower - kept for reference)
+            'exact' solves each layer to machine precision in a handful of passes regardless of eps - see _run_exact
+        checkpoint_dir: str, optional
+            if given each layer is written here as soon as it is finished - see piggy.utils.checkpoint
+        resume: bool, optional
+            if True (and there is a checkpoint in checkpoint_dir) start from the layer after the last finished one
+            rather than from scratch
+        progress_callback: callable, optional
+            called with the stats of each layer (see layer_stats) as soon as it is finished
+        instrumentation: piggy.utils.instrumentation.Instrumentation, optional
+            if given - times solving and checkpointing, counts layers and sweeps and records the stats of each layer
+        """
+        self.layer_stats = []
+        self._progress_callback = progress_callback
+        self._instrumentation = instrumentation
+        self._first_layer = 2 * (self.environment.target_score - 1)
+        self._checkpoint = None
+        if checkpoint_dir is not None:
+            self._checkpoint = LayerCheckpoint(checkpoint_dir, self.environment, self.playing_piglet)
+            if resume:
+                last_finished_layer = self._checkpoint.restore(self._V, self.policy)
+                if last_finished_layer is not None:
+                    self._first_layer = last_finished_layer - 1
+            else:
+                self._checkpoint.reset()
+
+        if engine == 'numpy':
+            self._run_numpy()
+        elif engine == 'exact':
+            self._run_exact()
+        elif engine == 'python':
+            self._run_python()
+        else:
+            raise ValueError('Unknown engine: {}'.format(engine))
+
+    def _layers(self):
+        """
+        Yields each score_sum layer still to be solved - highest first - checkpointing each once it is finished
+        """
+        instrumentation = self._instrumentation
+        for score_sum in tqdm(range(self._first_layer, -1, -1)):
+            start_time = time.time()
+            self._layer_deltas = []
+            with maybe_timer(instrumentation, 'solve'):
+                yield score_sum
+            if self._checkpoint is not None:
+                with maybe_timer(instrumentation, 'checkpoint'):
+                    self._checkpoint.write_layer(score_sum, self._V, self.policy)
+
+            delta_history = [float(delta) for delta in self._layer_deltas]
+            self.layer_stats.append({'score_sum': score_sum,
+                                     'sweeps': len(delta_history),
+                                     'delta': delta_history[-1] if delta_history else 0.0,
+                                     'delta_history': delta_history,
+                                     'wall_time': time.time() - start_time})
+            if instrumentation is not None:
+                instrumentation.count('layers')
+                instrumentation.count('sweeps', len(delta_history))
+                instrumentation.record('layer', **self.layer_stats[-1])
+            if self._progress_callback is not None:
+                self._progress_callback(self.layer_stats[-1])
+
+    def warm_start(self, value_function):
+        """
+        Initialise V from the solution of a variant with a different target score - e.g. target 100 when solving
+        target 110. States are matched by how far each player is from the target: V(a, b, t) ← V'(a - d, b - d, t)
+        where d is the difference in targets (clipped to the other variant's states).
+
+        Parameters
+        ----------
+        value_function: np.ndarray
+            [target' + 1, target' + 1, target' + 1] value function of the other variant e.g. from
+            piggy.solution_cache.get_solution
+        """
+        target_score = self.environment.target_score
+        other_target_score = value_function.shape[0] - 1
+        shift = target_score - other_target_score
+
+        your_score, opponent_score, turn_score = np.indices((target_score,)*3)
+        playable = your_score + turn_score < target_score
+        other_your_score = np.clip(your_score - shift, 0, other_target_score)
+        other_opponent_score = np.clip(opponent_score - shift, 0, other_target_score)
+        other_turn_score = np.minimum(turn_score, other_target_score - other_your_score)  # won if it reaches the end
+        self._V[:target_score, :target_score, :target_score][playable] = \
+            value_function[other_your_score, other_opponent_score, other_turn_score][playable]
+        self._warm_started = True
+
+    def _run_python(self):
 
         # Perform value iteration on disjoint subsets of states in which the sum of your score and opponents score equals
         # some value - starting with 2*(target-1) (i.e. both 1 away from winning) and working backward to 0 (start of game)
         # This technique was reported in Neller (2004) to improve convergence rate.
-        for score_sum in tqdm(range(2 * (self.environment.target_score - 1), -1, -1)):
+        scoring_points = self.die.scoring_points.tolist()
+        for score_sum in self._layers():
 
             delta = 1  # arbitrary number > eps to ensure while loop starts
             while delta >= self.eps:
                 delta = 0
-                for s in self.states:
+                for s in self.states.layer_tuples(score_sum):
+
+                    old_v = self.V(s)
+
+                    # If you hold - prob of winning = 1 - prob opponent winning
+                    v_hold = 1 - self.V((s[1], s[0] + s[2], 0))
 
-                    if s[0] + s[1] == score_sum:
+                    # If you roll
+                    v_roll = self.die.roll_value(1 - self.V((s[1], s[0], 0)),
+                                                 np.array([self.V((s[0], s[1], s[2] + points))
+                                                           for points in scoring_points]))
 
-                        old_v = self.V(s)
+                    new_v = max(v_hold, v_roll)
+                    self._V[s[0], s[1], s[2]] = new_v
+                    self.policy[s[0], s[1], s[2]] = np.argmax([v_hold, v_roll])
+                    delta = max(delta, abs(new_v - old_v))
 
-                        # If you hold - prob of winning = 1 - prob opponent winning
-                        v_hold = 1 - self.V((s[1], s[0] + s[2], 0))
+                self._layer_deltas.append(delta)
 
-                        # If you roll
-                        dice_sides = self.environment.dice_sides
-                        # Line below is to account for fact that piglet you score 1 for heads rather than 2
-                        scoring_rolls = [1] if self.playing_piglet else list(range(2, dice_sides+1))
-                        v_roll = (1 / dice_sides) * ((1 - self.V((s[1], s[0], 0))) +
-                                                     sum([self.V((s[0], s[1], s[2] + roll_score))
-                                                          for roll_score in scoring_rolls]))
+    def _run_numpy(self):
 
-                        new_v = max(v_hold, v_roll)
-                        self._V[s[0], s[1], s[2]] = new_v
-                        self.policy[s[0], s[1], s[2]] = np.argmax([v_hold, v_roll])
-                        delta = max(delta, abs(new_v - old_v))
+        # Same layer-by-layer scheme as _run_python but each sweep updates every state in the layer at once (a Jacobi
+        # rather than Gauss-Seidel sweep). All neighbours are gathered from the padded V using precomputed flat indices.
+        die = self.die
+        flat_V = self._V.reshape(-1)  # view onto self._V
+
+        for score_sum in self._layers():
+
+            your_score, opponent_score, turn_score = self.states.layer(score_sum)
+
+            state_idx = np.ravel_multi_index((your_score, opponent_score, turn_score), self._V.shape)
+            hold_idx = np.ravel_multi_index((opponent_score, your_score + turn_score, 0 * turn_score), self._V.shape)
+            pig_out_idx = np.ravel_multi_index((opponent_score, your_score, 0 * turn_score), self._V.shape)
+            roll_idx = state_idx[:, None] + die.scoring_points[None, :]  # turn_score is the last (contiguous) axis
+
+            delta = 1  # arbitrary number > eps to ensure while loop starts
+            while delta >= self.eps:
+                v_hold = 1 - flat_V[hold_idx]
+                v_roll = die.roll_value(1 - flat_V[pig_out_idx], flat_V[roll_idx])
+
+                new_v = np.maximum(v_hold, v_roll)
+                delta = np.abs(new_v - flat_V[state_idx]).max()
+                flat_V[state_idx] = new_v
+                self._layer_deltas.append(delta)
+
+            # ties go to hold, as with np.argmax([v_hold, v_roll])
+            self.policy[your_score, opponent_score, turn_score] = v_roll > v_hold
+
+    def _run_exact(self):
+
+        # Within a layer the only cycle is between V(a,b,0) and V(b,a,0). Given y = V(b,a,0) a backward pass over
+        # turn_score gives every value in row a as α + β·y for the actions that are greedy at y, so V(a,b,0) is a
+        # piecewise linear function of V(b,a,0) - solved by Newton's method on this 1-D coupling (see
+        # solve_layer_newton). The rest of the layer is then filled in from α and β in one pass.
+        target_score = self.environment.target_score
+
+        for score_sum in self._layers():
+
+            your_score, opponent_score = get_layer_rows(score_sum, target_score)
+
+            # Holding with turn score t leaves the opponent to play from (b, a + t, 0) in a higher layer
+            hold_value = 1 - self._V[opponent_score[:, None], get_hold_scores(your_score, target_score), 0]
+            ones = np.ones(len(your_score))
+
+            # Initial guess for V(b,a,0) of each row - Newton needs fewer steps from a warm start
+            y = self._V[opponent_score, your_score, 0] if self._warm_started else np.full(len(your_score), 0.5)
+            alpha, beta, roll, y, deltas = solve_layer_newton(your_score, target_score, self.die, hold_value,
+                                                              pig_out_alpha=ones, pig_out_beta=-ones, coupling_value=y)
+            self._layer_deltas.extend(deltas)
+
+            self._V[your_score, opponent_score, :target_score] = \
+                alpha[:, :target_score] + beta[:, :target_score] * y[:, None]
+            self.policy[your_score, opponent_score, :target_score] = roll
 
 
     def get_playable_state_to_value(self):
@@ -112,23 +282,23 @@ class ValueIteration:
         """
         return {state: self.V(state) for state in self.states}
 
-    def save(self, output_dir):
+    def save(self, output_dir, value_dtype=np.float64):
         """
-        Save value function as .npy
+        Save value function and policy - see piggy.utils.policy_store
         Parameters
         ----------
         output_dir: str
-        """
-        filepath_template = os.path.join(output_dir, '{}__{}_side_die__target_{}.npy'
-                                         .format('{}',
-                                                 self.environment.dice_sides,
-                                                 self.environment.target_score))
-
-        vf_filepath = filepath_template.format('value_func')
-        np.save(vf_filepath, self._V)
+        value_dtype: np.dtype, optional
+            float64 (default) or float32
 
-        policy_filepath = filepath_template.format('policy')
-        np.save(policy_filepath, self.policy)
+        Returns
+        -------
+        vf_filepath: str
+        policy_filepath: str
+        """
+        name = '{}_side_die__target_{}'.format(self.environment.dice_sides, self.environment.target_score)
+        return save_solution(output_dir, name, self._V, self.policy, self.environment, self.playing_piglet,
+                             value_dtype=value_dtype)
 
 
 
@@ -0,0 +1,33 @@
+import random
+
+import numpy as np
+
+from piggy.utils.die import Die
+
+# Two faces lose the turn and the scoring faces are unequally likely - outcomes (points) 0, 2, 3, 4 and 7
+BIASED_FACES = {1: (0.1, 0), 2: (0.3, 2), 3: (0.1, 3), 4: (0.2, 4), 5: (0.05, 0), 6: (0.25, 7)}
+
+
+def test_faces_with_the_same_points_are_merged():
+    die = Die(BIASED_FACES)
+    assert die.outcome_points.tolist() == [0, 2, 3, 4, 7]
+    assert np.allclose(die.outcome_probabilities, [0.15, 0.3, 0.1, 0.2, 0.25])
+    assert die.max_points == 7
+
+
+def _assert_frequencies_match(die, points):
+    # 99.9% confidence interval of each outcome's frequency - with a fixed seed this is deterministic
+    frequencies = np.array([np.mean(points == outcome_points) for outcome_points in die.outcome_points])
+    half_width = 3.29 * np.sqrt(die.outcome_probabilities * (1 - die.outcome_probabilities) / len(points))
+    assert np.all(np.abs(frequencies - die.outcome_probabilities) < half_width)
+
+
+def test_sample_matches_outcome_probabilities():
+    die = Die(BIASED_FACES)
+    _assert_frequencies_match(die, die.sample(10 ** 6, np.random.default_rng(0)))
+
+
+def test_sample_one_matches_outcome_probabilities():
+    die = Die(BIASED_FACES)
+    random_state = random.Random(0)
+    _assert_frequencies_match(die, np.array([die.sample_one(random_state) for _ in range(2 * 10 ** 5)]))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from piggy.agent import Agent
+from piggy.environment import Environment
+from piggy.evaluator import Evaluator
+from piggy.exact_evaluator import ExactEvaluator
+from piggy.utils.create_policy import hold_at_n_policy
+
+BIASED_FACES = {1: (0.1, 0), 2: (0.3, 2), 3: (0.1, 3), 4: (0.2, 4), 5: (0.05, 0), 6: (0.25, 7)}
+
+
+def _get_evaluators(target_score=50, faces=None):
+    environment = Environment(dice_sides=6, target_score=target_score, faces=faces)
+    player0 = Agent(initial_policy=hold_at_n_policy(target_score=target_score, hold_at=10))
+    player1 = Agent(initial_policy=hold_at_n_policy(target_score=target_score, hold_at=20))
+    return Evaluator(environment, player0, player1), ExactEvaluator(environment, player0, player1)
+
+
+@pytest.mark.parametrize('faces', [None, BIASED_FACES])
+def test_batched_win_rate_matches_exact(faces):
+    evaluator, exact_evaluator = _get_evaluators(faces=faces)
+    num_games = 100000
+    p0_win_rate, p1_win_rate = evaluator.evaluate(num_games=num_games, batch_size=10000, seed=0)
+    exact_p0_win_probability, _ = exact_evaluator.evaluate()
+
+    # 99.9% confidence interval of the simulated win rate - with a fixed seed this is deterministic
+    half_width = 3.29 * np.sqrt(exact_p0_win_probability * (1 - exact_p0_win_probability) / num_games)
+    assert abs(p0_win_rate - exact_p0_win_probability) < half_width
+    assert p0_win_rate + p1_win_rate == 1
+
+
+def test_batched_result_is_the_same_for_any_number_of_workers():
+    evaluator, _ = _get_evaluators()
+    kwargs = dict(num_games=60000, batch_size=5000, seed=1)
+    assert evaluator.evaluate(workers=1, **kwargs) == evaluator.evaluate(workers=2, **kwargs)
+
+
+@pytest.mark.parametrize('kwargs', [dict(max_games=1), dict(pairs_per_round=0), dict(ci_width=0),
+                                    dict(confidence=0), dict(confidence=1)])
+def test_sequential_rejects_invalid_arguments(kwargs):
+    evaluator, _ = _get_evaluators()
+    with pytest.raises(ValueError):
+        evaluator.evaluate_sequential(**kwargs)
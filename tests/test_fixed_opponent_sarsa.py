@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+
+from piggy.agent import Agent
+from piggy.environment import Environment
+from piggy.fixed_opponent_sarsa import FixedOpponentSarsa, apply_merged_td_updates
+from piggy.utils.create_policy import hold_at_n_policy
+
+
+def _get_sarsa(target_score=30):
+    np.random.seed(0)
+    random.seed(0)
+    environment = Environment(dice_sides=6, target_score=target_score)
+    opponent = Agent(initial_policy=hold_at_n_policy(target_score=target_score, hold_at=10))
+    return FixedOpponentSarsa(environment, opponent, eps=0.1, alpha=0.1, decay=0.99996, seed=0)
+
+
+def test_batched_learns_as_well_as_serial():
+    """ After the same number of episodes both reach a comparable win rate against the fixed opponent """
+    episodes = 60000
+    serial = _get_sarsa()
+    initial_win_rate = serial.evaluate_against_fixed_opponent()
+    serial.run(episodes, evaluate_every=episodes, background_evaluation=False)
+    batched = _get_sarsa()
+    batched.run_batched(episodes, evaluate_every=episodes, batch_size=100, seed=0, background_evaluation=False)
+
+    serial_win_rate = serial.evaluate_against_fixed_opponent()
+    batched_win_rate = batched.evaluate_against_fixed_opponent()
+    assert min(serial_win_rate, batched_win_rate) > initial_win_rate + 0.1
+    assert abs(serial_win_rate - batched_win_rate) < 0.05
+
+
+def test_merged_updates_match_sequential_updates():
+    """ Updates to the same (s, a) towards the same target merge into one equivalent update """
+    rng = np.random.default_rng(0)
+    flat_Q = rng.random(10)
+    state_idx = np.array([3, 3, 3, 5, 7, 7, 3])
+    target = rng.random(10)[state_idx]  # the same target for every update to an (s, a)
+    alpha = np.array([0.1, 0.3, 0.05])[np.unique(state_idx, return_inverse=True)[1]]
+
+    expected_Q = flat_Q.copy()
+    for i, alpha_i, target_i in zip(state_idx, alpha, target):
+        expected_Q[i] += alpha_i * (target_i - expected_Q[i])
+
+    num_updated = apply_merged_td_updates(flat_Q, state_idx, target - flat_Q[state_idx], alpha)
+    assert num_updated == 3
+    assert np.allclose(flat_Q, expected_Q)
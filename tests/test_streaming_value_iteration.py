@@ -0,0 +1,30 @@
+import numpy as np
+
+from piggy.environment import Environment
+from piggy.streaming_value_iteration import StreamingValueIteration
+from piggy.value_iteration import ValueIteration
+
+
+def test_chunked_layers_match_exact_engine(tmp_path):
+    """ A memory budget of a few rows forces every large layer to be solved in several chunks """
+    target_score = 30
+    environment = Environment(dice_sides=6, target_score=target_score)
+
+    # Budget for the start of turn values plus 4 rows - a layer has up to target_score rows
+    start_of_turn_bytes = 8 * (target_score + 1) ** 2
+    bytes_per_row = 8 * (8 * (target_score + environment.die.max_points) + 4 * target_score)
+    streaming_value_iteration = StreamingValueIteration(environment, str(tmp_path),
+                                                        max_memory_bytes=start_of_turn_bytes + 4 * bytes_per_row)
+    assert streaming_value_iteration.max_rows_per_chunk == 4
+    streaming_value_iteration.run()
+    V, policy = streaming_value_iteration.load()
+
+    value_iteration = ValueIteration(environment=environment, eps=0)
+    value_iteration.run(engine='exact')
+
+    your_score, _, turn_score = np.indices((target_score,)*3)
+    playable = your_score + turn_score < target_score
+    playable_states = np.s_[:target_score, :target_score, :target_score]
+    assert np.abs(V[:target_score + 1, :target_score + 1, :target_score + 1] -
+                  value_iteration._V[:target_score + 1, :target_score + 1, :target_score + 1]).max() < 1e-12
+    assert np.array_equal(policy[playable] > 0, value_iteration.policy[playable_states][playable] > 0.5)
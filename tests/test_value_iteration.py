@@ -0,0 +1,47 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+import piggy.value_iteration
+from piggy.environment import Environment
+from piggy.value_iteration import ValueIteration
+
+BIASED_FACES = {1: (0.1, 0), 2: (0.3, 2), 3: (0.1, 3), 4: (0.2, 4), 5: (0.05, 0), 6: (0.25, 7)}
+
+
+def _solve(target_score, engine, faces=None):
+    np.random.seed(0)
+    environment = Environment(dice_sides=6, target_score=target_score, faces=faces)
+    value_iteration = ValueIteration(environment=environment, eps=1e-12)
+    value_iteration.run(engine=engine)
+    return value_iteration
+
+
+@pytest.mark.parametrize('target_score, faces', [(20, None), (30, None), (30, BIASED_FACES)])
+def test_engines_agree(target_score, faces):
+    """ The vectorized and exact engines match the original state-by-state engine on small targets """
+    your_score, _, turn_score = np.indices((target_score,)*3)
+    playable = your_score + turn_score < target_score
+    playable_states = np.s_[:target_score, :target_score, :target_score]
+
+    reference = _solve(target_score, 'python', faces)
+    for engine in ('numpy', 'exact'):
+        value_iteration = _solve(target_score, engine, faces)
+        V_difference = value_iteration._V[playable_states] - reference._V[playable_states]
+        assert np.abs(V_difference[playable]).max() < 1e-8
+        assert np.array_equal(value_iteration.policy[playable_states][playable] > 0.5,
+                              reference.policy[playable_states][playable] > 0.5)
+
+
+def test_exact_engine_falls_back_to_sweeps(monkeypatch):
+    """ Capping Newton's method at a single iteration forces the value iteration fallback in every layer """
+    target_score = 30
+    reference = _solve(target_score, 'exact')
+    monkeypatch.setattr(piggy.value_iteration, 'solve_layer_newton',
+                        partial(piggy.value_iteration.solve_layer_newton, max_iterations=1))
+    value_iteration = _solve(target_score, 'exact')
+
+    playable_states = np.s_[:target_score, :target_score, :target_score]
+    assert np.abs(value_iteration._V[playable_states] - reference._V[playable_states]).max() < 1e-12
+    assert max(stats['sweeps'] for stats in value_iteration.layer_stats) > 1